@@ -3,16 +3,18 @@
 # Copyright 2023 Canonical, Ltd.
 #
 
+import hashlib
 import json
 import logging
+import os
 import socket
 import subprocess
 import time
 from typing import Any, Union
 
-from charms.grafana_agent.v0.cos_agent import COSAgentProvider
 from ops import CharmBase, main
 from ops.charm import (
+    ActionEvent,
     ConfigChangedEvent,
     InstallEvent,
     LeaderElectedEvent,
@@ -24,16 +26,51 @@ from ops.charm import (
     UpdateStatusEvent,
     UpgradeCharmEvent,
 )
-from ops.framework import StoredState
-from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, WaitingStatus
+from ops.framework import PreCommitEvent, StoredState
+from ops.model import (
+    ActiveStatus,
+    BlockedStatus,
+    MaintenanceStatus,
+    StatusBase,
+    WaitingStatus,
+)
 
-import containerd
-import metrics
-import microk8s
+import instrumentation
+import profiling
 import util
 
+# modules are loaded on first use, so that each hook only imports what it needs
+containerd = util.lazy_import("containerd")
+cos_provider = util.lazy_import("cos_provider")
+kubeapi = util.lazy_import("kubeapi")
+metrics = util.lazy_import("metrics")
+microk8s = util.lazy_import("microk8s")
+
 LOG = logging.getLogger(__name__)
 
+# configuration keys that each configuration handler depends on
+CONFIG_HANDLER_KEYS = {
+    "config_containerd_proxy": [
+        "containerd_http_proxy",
+        "containerd_https_proxy",
+        "containerd_no_proxy",
+    ],
+    "config_containerd_registries": ["containerd_custom_registries"],
+    "config_hostpath_storage": ["hostpath_storage"],
+    "config_certificate_reissue": ["automatic_certificate_reissue"],
+    "config_extra_sans": ["extra_sans"],
+    "config_rbac": ["rbac"],
+    "config_profile_hooks": ["profile_hooks"],
+    "config_metrics_profile": ["metrics_profile"],
+    "config_scrape_intervals": ["scrape_intervals"],
+    "config_kube_state_metrics": ["kube_state_metrics_endpoint", "kube_state_metrics_shards"],
+}
+
+
+def _fingerprint(data: Any) -> str:
+    """return a stable hash of json-serializable data"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
 
 class MicroK8sCharm(CharmBase):
     _state = StoredState()
@@ -49,8 +86,13 @@ class MicroK8sCharm(CharmBase):
     def __init__(self, *args):
         super().__init__(*args)
 
+        # set after the node has been verified to be ready, see _wait_ready()
+        self._ready = False
+        # name of the last status set in this hook, see _set_status()
+        self._status_name = None
+
         if self.config["role"] not in ["", "worker", "control-plane"]:
-            self.unit.status = BlockedStatus("role must be one of '', 'worker', 'control-plane'")
+            self._set_status(BlockedStatus("role must be one of '', 'worker', 'control-plane'"))
             return
 
         self._state.set_default(
@@ -58,8 +100,13 @@ class MicroK8sCharm(CharmBase):
             installed=False,
             joined=False,
             hostnames={},
+            config_hashes={},
+            last_status="unknown",
         )
 
+        self.framework.observe(self.framework.on.pre_commit, self._record_status)
+        self.framework.observe(self.on.get_profiles_action, self.on_get_profiles_action)
+
         if self.config["role"] == "worker":
             # lifecycle
             self.framework.observe(self.on.remove, self.on_remove)
@@ -68,11 +115,7 @@ class MicroK8sCharm(CharmBase):
             self.framework.observe(self.on.update_status, self.update_status)
 
             # configuration
-            self.framework.observe(self.on.config_changed, self.config_ensure_role)
-            self.framework.observe(self.on.config_changed, self.on_install)
-            self.framework.observe(self.on.config_changed, self.config_containerd_proxy)
-            self.framework.observe(self.on.config_changed, self.config_containerd_registries)
-            self.framework.observe(self.on.config_changed, self.update_status)
+            self.framework.observe(self.on.config_changed, self.on_config_changed)
 
             # clustering
             self.framework.observe(self.on.control_plane_relation_joined, self.on_install)
@@ -94,15 +137,7 @@ class MicroK8sCharm(CharmBase):
             self.framework.observe(self.on.update_status, self.update_metrics_tls_auth)
 
             # configuration
-            self.framework.observe(self.on.config_changed, self.config_ensure_role)
-            self.framework.observe(self.on.config_changed, self.on_install)
-            self.framework.observe(self.on.config_changed, self.config_containerd_proxy)
-            self.framework.observe(self.on.config_changed, self.config_containerd_registries)
-            self.framework.observe(self.on.config_changed, self.config_hostpath_storage)
-            self.framework.observe(self.on.config_changed, self.config_certificate_reissue)
-            self.framework.observe(self.on.config_changed, self.config_extra_sans)
-            self.framework.observe(self.on.config_changed, self.config_rbac)
-            self.framework.observe(self.on.config_changed, self.update_status)
+            self.framework.observe(self.on.config_changed, self.on_config_changed)
 
             # clustering
             self.framework.observe(self.on.peer_relation_joined, self.add_node)
@@ -130,126 +165,283 @@ class MicroK8sCharm(CharmBase):
                 self.on.cos_agent_relation_joined, self.apply_observability_resources
             )
             self.framework.observe(self.on.cos_agent_relation_joined, self.update_metrics_tls_auth)
-            self._cos = COSAgentProvider(
-                self,
-                relation_name="cos-agent",
-                scrape_configs=self._build_scrape_configs,
-                metrics_rules_dir="src/prometheus_alert_rules",
-                dashboard_dirs=["src/grafana_dashboards"],
-                refresh_events=[self.on.peer_relation_changed, self.on.upgrade_charm],
-            )
 
+            # importing and constructing the provider is expensive, skip it until related
+            hook = os.environ.get("JUJU_DISPATCH_PATH", "").split("/")[-1]
+            if self.model.relations["cos-agent"] or hook.startswith("cos-agent-relation-"):
+                self._cos = cos_provider.COSAgentProvider(
+                    self,
+                    relation_name="cos-agent",
+                    scrape_configs=self._build_scrape_configs,
+                    metrics_rules_dir="src/prometheus_alert_rules",
+                    dashboard_dirs=["src/grafana_dashboards"],
+                    # the leader scrapes kube-state-metrics. units that are not the leader get
+                    # leader-settings-changed when leadership changes, and stop scraping it
+                    refresh_events=[
+                        self.on.peer_relation_changed,
+                        self.on.upgrade_charm,
+                        self.on.config_changed,
+                        self.on.leader_elected,
+                        self.on.leader_settings_changed,
+                    ],
+                )
+
+    def _set_status(self, status: StatusBase):
+        self.unit.status = status
+        self._status_name = status.name
+
+    def _record_status(self, _: PreCommitEvent):
+        # compare the status set in this hook, reading the unit status would call status-get
+        status = self._status_name
+        if status is not None and status != self._state.last_status:
+            instrumentation.record_status_transition(self._state.last_status, status)
+            self._state.last_status = status
+
+    def _install_exporter(self, restart: bool = False):
+        try:
+            metrics.install_exporter(restart)
+        except (subprocess.CalledProcessError, OSError):
+            LOG.exception("failed to install charm metrics exporter")
+
+    @instrumentation.timed
     def on_remove(self, _: RemoveEvent):
         try:
             microk8s.uninstall()
         except subprocess.CalledProcessError:
             LOG.exception("failed to remove microk8s")
 
+        try:
+            metrics.remove_exporter()
+        except OSError:
+            LOG.exception("failed to remove charm metrics exporter")
+
+    @instrumentation.timed
     def on_upgrade(self, _: UpgradeCharmEvent):
         # TODO(neoaggelos): Figure out an orchestrated upgrade strategy
         microk8s.upgrade()
+        self._install_exporter(restart=True)
+
+        # the new charm revision may apply configuration differently, re-apply everything
+        self._state.config_hashes = {}
 
+    @instrumentation.timed
     def on_install(self, _: InstallEvent):
         if self._state.installed:
             return
 
-        self.unit.status = MaintenanceStatus("installing required packages")
+        self._set_status(MaintenanceStatus("installing required packages"))
         util.install_required_packages()
 
-        self.unit.status = MaintenanceStatus("installing MicroK8s")
+        self._set_status(MaintenanceStatus("installing MicroK8s"))
         microk8s.install()
         try:
             microk8s.wait_ready()
-        except subprocess.CalledProcessError:
+            self._ready = True
+        except (subprocess.CalledProcessError, TimeoutError):
             LOG.exception("timed out waiting for node to come up")
 
+        self._install_exporter()
+
         self._state.installed = True
         self._state.joined = False
+        self._state.config_hashes = {}
+
+    def _wait_ready(self):
+        """wait for the node to become ready. this is done at most once per dispatch"""
+        if not self._ready:
+            microk8s.wait_ready()
+            self._ready = True
+
+    def _config_handlers(self) -> list:
+        """return the configuration handlers that have work to do on this unit, in order"""
+        handlers = [
+            self.config_profile_hooks,
+            self.config_metrics_profile,
+            self.config_scrape_intervals,
+            self.config_containerd_proxy,
+            self.config_containerd_registries,
+        ]
+
+        if self.config["role"] == "worker" or not self._state.joined:
+            return handlers
 
+        if self.unit.is_leader():
+            handlers.append(self.config_hostpath_storage)
+            if self.model.relations["cos-agent"]:
+                handlers.append(self.config_kube_state_metrics)
+        if not self.config["automatic_certificate_reissue"]:
+            handlers.append(self.config_certificate_reissue)
+
+        return handlers + [self.config_extra_sans, self.config_rbac]
+
+    @instrumentation.timed
+    def on_config_changed(self, event: ConfigChangedEvent):
+        """reconcile the unit configuration in a single pass"""
+        self.config_ensure_role(event)
+        if isinstance(self.unit.status, BlockedStatus):
+            return
+
+        self.on_install(event)
+
+        handlers = self._config_handlers()
+
+        # forget handlers that have no work to do, so that they run once they do
+        for name in set(self._state.config_hashes) - {h.__name__ for h in handlers}:
+            del self._state.config_hashes[name]
+
+        for handler in handlers:
+            name = handler.__name__
+            config_hash = _fingerprint({k: self.config[k] for k in CONFIG_HANDLER_KEYS[name]})
+            if self._state.config_hashes.get(name) == config_hash:
+                LOG.debug("Skip %s, configuration has not changed", name)
+                continue
+
+            handler(event)
+            if isinstance(self.unit.status, BlockedStatus):
+                return
+
+            self._state.config_hashes[name] = config_hash
+
+        self.update_status(event)
+
+    @instrumentation.timed
     def config_ensure_role(self, _: ConfigChangedEvent):
         if self.config["role"] != self._state.role:
             msg = f"role cannot change from '{self._state.role}' after deployment"
-            self.unit.status = BlockedStatus(msg)
+            self._set_status(BlockedStatus(msg))
         else:
-            self.unit.status = MaintenanceStatus("maintenance")
+            self._set_status(MaintenanceStatus("maintenance"))
 
-    def config_containerd_proxy(self, _: ConfigChangedEvent):
-        if isinstance(self.unit.status, BlockedStatus):
+    @instrumentation.timed
+    def config_profile_hooks(self, _: ConfigChangedEvent):
+        try:
+            modes = profiling.parse_modes(self.config["profile_hooks"])
+        except ValueError:
+            LOG.exception("invalid profile_hooks")
+            self._set_status(BlockedStatus("invalid profile_hooks, check logs for details"))
             return
 
+        profiling.set_modes(util.charm_dir() / "profiles", modes)
+
+    @instrumentation.timed
+    def config_metrics_profile(self, _: ConfigChangedEvent):
+        # scrape jobs are rebuilt by the cos-agent provider on config-changed
+        if self.config["metrics_profile"] not in metrics.METRICS_PROFILES:
+            msg = f"metrics_profile must be one of {metrics.METRICS_PROFILES}"
+            self._set_status(BlockedStatus(msg))
+
+    @instrumentation.timed
+    def config_scrape_intervals(self, _: ConfigChangedEvent):
+        # scrape jobs are rebuilt by the cos-agent provider on config-changed
+        try:
+            metrics.parse_scrape_intervals(self.config["scrape_intervals"])
+        except ValueError:
+            LOG.exception("invalid scrape_intervals")
+            self._set_status(BlockedStatus("invalid scrape_intervals, check logs for details"))
+
+    @instrumentation.timed
+    def config_containerd_proxy(self, _: ConfigChangedEvent):
         microk8s.set_containerd_proxy_options(
             self.config["containerd_http_proxy"],
             self.config["containerd_https_proxy"],
             self.config["containerd_no_proxy"],
         )
 
+    @instrumentation.timed
     def config_containerd_registries(self, _: ConfigChangedEvent):
-        if isinstance(self.unit.status, BlockedStatus):
-            return
-
         try:
             registries = containerd.parse_registries(self.config["containerd_custom_registries"])
             if registries:
-                self.unit.status = MaintenanceStatus("configure containerd registries")
+                self._set_status(MaintenanceStatus("configure containerd registries"))
                 containerd.ensure_registry_configs(registries)
         except (ValueError, subprocess.CalledProcessError, OSError):
             LOG.exception("failed to configure containerd registries")
-            self.unit.status = BlockedStatus(
-                "failed to apply containerd_custom_registries, check logs for details"
+            self._set_status(
+                BlockedStatus(
+                    "failed to apply containerd_custom_registries, check logs for details"
+                )
             )
 
+    @instrumentation.timed
     def config_rbac(self, _: ConfigChangedEvent):
-        if isinstance(self.unit.status, BlockedStatus):
-            return
-
-        if self._state.joined:
-            self.unit.status = MaintenanceStatus("configuring RBAC")
-            microk8s.wait_ready()
-            microk8s.configure_rbac(self.config["rbac"])
+        self._set_status(MaintenanceStatus("configuring RBAC"))
+        self._wait_ready()
+        microk8s.configure_rbac(self.config["rbac"])
 
+    @instrumentation.timed
     def config_hostpath_storage(self, _: ConfigChangedEvent):
-        if isinstance(self.unit.status, BlockedStatus):
+        microk8s.configure_hostpath_storage(self.config["hostpath_storage"])
+
+    @instrumentation.timed
+    def config_kube_state_metrics(self, _: ConfigChangedEvent):
+        endpoint = self.config["kube_state_metrics_endpoint"]
+        if endpoint not in metrics.KUBE_STATE_METRICS_ENDPOINTS:
+            msg = (
+                f"kube_state_metrics_endpoint must be one of {metrics.KUBE_STATE_METRICS_ENDPOINTS}"
+            )
+            self._set_status(BlockedStatus(msg))
             return
 
-        if self._state.joined and self.unit.is_leader():
-            microk8s.configure_hostpath_storage(self.config["hostpath_storage"])
-
-    def config_certificate_reissue(self, _: ConfigChangedEvent):
-        if isinstance(self.unit.status, BlockedStatus):
+        shards = self.config["kube_state_metrics_shards"]
+        if not 1 <= shards <= metrics.KUBE_STATE_METRICS_MAX_SHARDS:
+            msg = f"kube_state_metrics_shards must be 1-{metrics.KUBE_STATE_METRICS_MAX_SHARDS}"
+            self._set_status(BlockedStatus(msg))
             return
 
-        if self._state.joined and not self.config["automatic_certificate_reissue"]:
-            self.unit.status = MaintenanceStatus("disabling automatic certificate reissue")
-            microk8s.wait_ready()
-            microk8s.disable_cert_reissue()
+        self._set_status(MaintenanceStatus("configuring kube-state-metrics"))
+        self._wait_ready()
+        metrics.apply_required_resources(endpoint, shards)
 
+    @instrumentation.timed
+    def config_certificate_reissue(self, _: ConfigChangedEvent):
+        self._set_status(MaintenanceStatus("disabling automatic certificate reissue"))
+        self._wait_ready()
+        microk8s.disable_cert_reissue()
+
+    @instrumentation.timed
     def config_extra_sans(self, _: ConfigChangedEvent):
         if isinstance(self.unit.status, BlockedStatus):
             return
 
         if self._state.joined:
-            self.unit.status = MaintenanceStatus("configuring extra SANs")
-            microk8s.configure_extra_sans(self.config["extra_sans"])
+            self._set_status(MaintenanceStatus("configuring extra SANs"))
+            if microk8s.configure_extra_sans(self.config["extra_sans"]):
+                # refreshing the certificates restarts the kube-apiserver
+                self._ready = False
 
+    @instrumentation.timed
     def update_status(self, _: Union[UpdateStatusEvent, ConfigChangedEvent]):
         if isinstance(self.unit.status, BlockedStatus):
             return
 
         if not self._state.joined:
-            self.unit.status = WaitingStatus("waiting for control plane")
+            self._set_status(WaitingStatus("waiting for control plane"))
             return
 
-        self.unit.status = microk8s.get_unit_status(socket.gethostname())
-        while not isinstance(self.unit.status, ActiveStatus):
+        # wait for the node to become ready, but never past the configured deadline
+        start = time.monotonic()
+        deadline = start + self.config["node_ready_timeout"]
+        status = microk8s.get_unit_status(socket.gethostname())
+        while not isinstance(status, ActiveStatus) and time.monotonic() + 2 < deadline:
             time.sleep(2)
-            self.unit.status = microk8s.get_unit_status(socket.gethostname())
+            status = microk8s.get_unit_status(socket.gethostname())
+
+        waited = time.monotonic() - start
+        instrumentation.record_node_ready_wait(waited)
+        if not isinstance(status, ActiveStatus):
+            LOG.warning("node not ready after %.1fs", waited)
+            status = WaitingStatus(status.message)
+
+        self._set_status(status)
 
+    @instrumentation.timed
     def record_hostnames(self, event: Union[RelationChangedEvent, RelationJoinedEvent]):
         for unit in event.relation.units:
             hostname = event.relation.data[unit].get("hostname")
             if hostname is not None:
                 self._state.hostnames[unit.name] = hostname
 
+    @instrumentation.timed
     def on_relation_departed(self, event: RelationDepartedEvent):
         if event.departing_unit == self.unit:
             self._state.joined = False
@@ -263,6 +455,7 @@ class MicroK8sCharm(CharmBase):
             remove_nodes.append(remove_hostname)
             self._set_peer_data("remove_nodes", remove_nodes)
 
+    @instrumentation.timed
     def remove_departed_nodes(self, _: Union[RelationDepartedEvent, LeaderElectedEvent]):
         if self._state.joined and self.unit.is_leader():
             remove_nodes = self._get_peer_data("remove_nodes", [])
@@ -274,7 +467,7 @@ class MicroK8sCharm(CharmBase):
                     new_remove_nodes.append(hostname)
                     continue
 
-                self.unit.status = MaintenanceStatus(f"removing node {hostname}")
+                self._set_status(MaintenanceStatus(f"removing node {hostname}"))
                 try:
                     microk8s.remove_node(hostname)
                 except subprocess.CalledProcessError:
@@ -283,19 +476,23 @@ class MicroK8sCharm(CharmBase):
 
             self._set_peer_data("remove_nodes", new_remove_nodes)
 
+    @instrumentation.timed
     def open_ports(self, _: InstallEvent):
         self.unit.open_port("tcp", 16443)
 
+    @instrumentation.timed
     def announce_hostname(self, event: Union[RelationJoinedEvent, RelationChangedEvent]):
         hostname = socket.gethostname()
         self._state.hostnames[self.unit.name] = hostname
         event.relation.data[self.unit]["hostname"] = hostname
 
+    @instrumentation.timed
     def bootstrap_cluster(self, _: InstallEvent):
         # FIXME(neoaggelos): possible race condition if leadership changes during bootstrap
         if self.unit.is_leader():
             self._state.joined = True
 
+    @instrumentation.timed
     def join_cluster(self, event: Union[RelationJoinedEvent, RelationChangedEvent]):
         if self._state.joined or (self.config["role"] != "worker" and self.unit.is_leader()):
             return
@@ -305,22 +502,26 @@ class MicroK8sCharm(CharmBase):
             LOG.info("join URL not yet available")
             return
 
-        self.unit.status = MaintenanceStatus("joining cluster")
+        self._set_status(MaintenanceStatus("joining cluster"))
         microk8s.join(join_url, self.config["role"] == "worker")
         microk8s.wait_ready()
+        self._ready = True
         self._state.joined = True
 
+    @instrumentation.timed
     def leave_cluster(self, _: RelationBrokenEvent):
         if not self._state.joined:
             return
 
         LOG.info("leaving cluster")
-        self.unit.status = MaintenanceStatus("leaving cluster")
+        self._set_status(MaintenanceStatus("leaving cluster"))
         microk8s.uninstall()
 
         self._state.installed = False
         self._state.joined = False
+        self._state.config_hashes = {}
 
+    @instrumentation.timed
     def add_node(self, event: RelationJoinedEvent):
         if not self.unit.is_leader():
             return
@@ -330,20 +531,25 @@ class MicroK8sCharm(CharmBase):
             self.model.get_binding(event.relation).network.ingress_address, token
         )
 
+    @instrumentation.timed
     def apply_observability_resources(self, _: RelationJoinedEvent):
         if isinstance(self.unit.status, BlockedStatus):
             return
 
         if self._state.joined and self.unit.is_leader():
-            metrics.apply_required_resources()
+            metrics.apply_required_resources(
+                self.config["kube_state_metrics_endpoint"],
+                self.config["kube_state_metrics_shards"],
+            )
 
+    @instrumentation.timed
     def update_metrics_tls_auth(self, _: Any):
         if not self.unit.is_leader() or not self.model.relations["cos-agent"]:
             return
 
         try:
             crt, key = metrics.get_tls_auth()
-        except subprocess.CalledProcessError:
+        except (subprocess.CalledProcessError, OSError, kubeapi.KubernetesError):
             LOG.exception("failed to retrieve tls_auth for observability")
             return
 
@@ -351,6 +557,26 @@ class MicroK8sCharm(CharmBase):
             relation.data[self.app]["metrics_crt"] = crt
             relation.data[self.app]["metrics_key"] = key
 
+    @instrumentation.timed
+    def on_get_profiles_action(self, event: ActionEvent):
+        files = profiling.latest(util.charm_dir() / "profiles", event.params["count"])
+        if not files:
+            event.fail("no profiles available, enable them with the profile_hooks config option")
+            return
+
+        results = {
+            "summary": "\n".join(
+                f"=== {file.name}\n{profiling.summarize(file, event.params['top'])}"
+                for file in files
+            )
+        }
+        if event.params["archive"]:
+            path = util.charm_dir() / "profiles.tar.gz"
+            profiling.archive(files, path)
+            results["archive"] = path.as_posix()
+
+        event.set_results(results)
+
     def _build_scrape_configs(self) -> list:
         if not self._state.joined:
             return []
@@ -366,8 +592,50 @@ class MicroK8sCharm(CharmBase):
             LOG.debug("metrics token not yet available")
             return []
 
-        return metrics.build_scrape_jobs(crt, key, is_control_plane, socket.gethostname())
+        metrics_profile = self.config["metrics_profile"]
+        if metrics_profile not in metrics.METRICS_PROFILES:
+            metrics_profile = "full"
+
+        try:
+            scrape_intervals = metrics.parse_scrape_intervals(self.config["scrape_intervals"])
+        except ValueError:
+            scrape_intervals = {}
+
+        # scrape the resources applied by config_kube_state_metrics until the config is fixed
+        ksm_endpoint = self.config["kube_state_metrics_endpoint"]
+        if ksm_endpoint not in metrics.KUBE_STATE_METRICS_ENDPOINTS:
+            LOG.warning("invalid kube_state_metrics_endpoint %s, using proxy", ksm_endpoint)
+            ksm_endpoint = "proxy"
+
+        ksm_shards = self.config["kube_state_metrics_shards"]
+        if not 1 <= ksm_shards <= metrics.KUBE_STATE_METRICS_MAX_SHARDS:
+            LOG.warning("invalid kube_state_metrics_shards %s, using 1", ksm_shards)
+            ksm_shards = 1
+
+        # kube-state-metrics is scraped by the leader only, see refresh_events of the provider
+        return metrics.build_scrape_jobs(
+            crt,
+            key,
+            is_control_plane,
+            socket.gethostname(),
+            self.unit.is_leader(),
+            ksm_endpoint,
+            ksm_shards,
+            metrics_profile,
+            scrape_intervals,
+        )
 
 
 if __name__ == "__main__":  # pragma: nocover
-    main(MicroK8sCharm, use_juju_for_storage=True)
+    hook = os.environ.get("JUJU_DISPATCH_PATH", "").split("/")[-1] or "unknown"
+    try:
+        profiling.run(
+            lambda: main(MicroK8sCharm, use_juju_for_storage=True),
+            util.charm_dir() / "profiles",
+            hook,
+        )
+    finally:
+        try:
+            instrumentation.write_report(util.charm_dir() / "instrumentation", hook)
+        except OSError:
+            LOG.warning("failed to write instrumentation report", exc_info=1)
@@ -0,0 +1,205 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+import hashlib
+import json
+import logging
+import os
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pydantic
+from charms.grafana_agent.v0 import cos_agent
+from cosl import JujuTopology
+from cosl.rules import AlertRules
+from ops.framework import StoredState
+
+import instrumentation
+import util
+
+LOG = logging.getLogger(__name__)
+
+# cache of serialized dashboards, relative to the charm directory
+DASHBOARDS_CACHE = Path("cache") / "dashboards.json"
+
+# cache of alert rules with juju topology, relative to the charm directory
+ALERT_RULES_CACHE = Path("cache") / "alert_rules.json"
+
+# rule files loaded by cosl
+RULE_SUFFIXES = [".rule", ".rules", ".yml", ".yaml"]
+
+# dashboards serialized when the charm is packed (see src/hack/build_dashboards.py), relative to
+# the charm directory
+DASHBOARDS_MANIFEST = Path("src") / "dashboards_manifest.json"
+
+
+def _load(file: Path) -> Dict[str, Any]:
+    try:
+        return json.loads(file.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(file: Path, data: Any):
+    try:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = file.with_name(f".{file.name}.tmp")
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, file)
+    except OSError:
+        LOG.warning("failed to write cache %s", file, exc_info=1)
+
+
+def _minify(raw: bytes) -> bytes:
+    """return dashboard JSON without whitespace. invalid JSON is returned unchanged"""
+    try:
+        return json.dumps(json.loads(raw), separators=(",", ":")).encode()
+    except ValueError:
+        return raw
+
+
+def serialize_dashboards(
+    dashboard_dirs: List[str], cache_file: Path, manifest_file: Optional[Path] = None
+) -> List[str]:
+    """serialize all dashboards in the directories. compressing dashboards is expensive, so
+    serialized dashboards are taken from the manifest built when packing the charm or from the
+    cache, if the content hash matches. only dashboards that changed are compressed again"""
+    cache = _load(cache_file)
+    manifest = _load(manifest_file) if manifest_file else {}
+
+    entries = {}
+    dashboards = []
+    for directory in dashboard_dirs:
+        for path in sorted(Path(directory).glob("*")):
+            key, raw = path.as_posix(), path.read_bytes()
+            digest = hashlib.sha256(raw).hexdigest()
+            entry = manifest.get(key)
+            if not isinstance(entry, dict) or entry.get("sha256") != digest:
+                # not in the manifest, e.g. the dashboard was changed after packing the charm
+                entry = cache.get(key)
+                if not isinstance(entry, dict) or entry.get("sha256") != digest:
+                    entry = {
+                        "sha256": digest,
+                        "data": cos_agent.GrafanaDashboard._serialize(_minify(raw)),
+                    }
+                entries[key] = entry
+
+            dashboards.append(cos_agent.GrafanaDashboard(entry["data"]))
+
+    if entries != cache:
+        _save(cache_file, entries)
+
+    return dashboards
+
+
+def _rules_digest(rules_path: Path, recursive: bool, topology: Dict[str, str]) -> str:
+    """return a hash of the rule files, the topology and the version of cosl"""
+    try:
+        cosl_version = metadata.version("cosl")
+    except metadata.PackageNotFoundError:
+        cosl_version = ""
+
+    h = hashlib.sha256(json.dumps([topology, recursive, cosl_version]).encode())
+    if rules_path.is_dir():
+        files = rules_path.glob("**/*" if recursive else "*")
+    else:
+        files = [rules_path]
+    for file in sorted(f for f in files if f.is_file() and f.suffix in RULE_SUFFIXES):
+        h.update(file.as_posix().encode())
+        h.update(hashlib.sha256(file.read_bytes()).digest())
+
+    return h.hexdigest()
+
+
+def load_alert_rules(
+    rules_path: str, recursive: bool, topology: Dict[str, str], cache_file: Path
+) -> Dict:
+    """load the alert rules and inject the juju topology. parsing the rules is expensive, so the
+    result is cached until the rule files or the topology change"""
+    digest = _rules_digest(Path(rules_path), recursive, topology)
+    cache = _load(cache_file)
+    if cache.get("sha256") == digest and isinstance(cache.get("data"), dict):
+        return cache["data"]
+
+    alert_rules = AlertRules(query_type="promql", topology=JujuTopology.from_dict(topology))
+    alert_rules.add_path(rules_path, recursive=recursive)
+    data = alert_rules.as_dict()
+
+    _save(cache_file, {"sha256": digest, "data": data})
+    return data
+
+
+class COSAgentProvider(cos_agent.COSAgentProvider):
+    """COSAgentProvider that caches the alert rules and serialized dashboards across hooks, and
+    only writes the relation data if it changed"""
+
+    _stored = StoredState()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stored.set_default(payload_hashes={})
+
+    def _on_refresh(self, event):
+        relations = [
+            relation
+            for relation in self._charm.model.relations[self._relation_name]
+            if relation.data and self._charm.unit in relation.data
+        ]
+        if not relations:
+            return
+
+        payload = {
+            "metrics_alert_rules": self._metrics_alert_rules,
+            "log_alert_rules": self._log_alert_rules,
+            "dashboards": self._dashboards,
+            "metrics_scrape_jobs": self._scrape_jobs,
+            "log_slots": self._log_slots,
+        }
+        digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+        hashes = {}
+        for relation in relations:
+            key = str(relation.id)
+            unit_data = relation.data[self._charm.unit]
+            if (
+                self._stored.payload_hashes.get(key) == digest
+                and cos_agent.CosAgentProviderUnitData.KEY in unit_data
+            ):
+                hashes[key] = digest
+                instrumentation.record_relation_write(self._relation_name, skipped=True)
+                continue
+
+            try:
+                data = cos_agent.CosAgentProviderUnitData(**payload)
+                unit_data[data.KEY] = data.json()
+                hashes[key] = digest
+                instrumentation.record_relation_write(self._relation_name, skipped=False)
+            except (pydantic.ValidationError, json.decoder.JSONDecodeError) as e:
+                LOG.error("Invalid relation data provided: %s", e)
+
+        # also drops the hashes of removed relations. only assign if changed, since every change
+        # to stored state is committed, which is a call to the controller with juju storage
+        if hashes != dict(self._stored.payload_hashes):
+            self._stored.payload_hashes = hashes
+
+    @property
+    def _metrics_alert_rules(self) -> Dict:
+        return load_alert_rules(
+            self._metrics_rules,
+            self._recursive,
+            {
+                "model": self._charm.model.name,
+                "model_uuid": self._charm.model.uuid,
+                "application": self._charm.app.name,
+            },
+            util.charm_dir() / ALERT_RULES_CACHE,
+        )
+
+    @property
+    def _dashboards(self) -> List[cos_agent.GrafanaDashboard]:
+        return serialize_dashboards(
+            self._dashboard_dirs,
+            util.charm_dir() / DASHBOARDS_CACHE,
+            util.charm_dir() / DASHBOARDS_MANIFEST,
+        )
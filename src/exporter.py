@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+#
+# Copyright 2023 Canonical, Ltd.
+#
+
+# Serve the metrics files written by the charm instrumentation (see instrumentation.py), so
+# that they can be scraped by grafana-agent. This runs as a systemd service outside of the
+# charm hooks, so it must only depend on the standard library.
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """serve the contents of all *.prom files in the metrics directory on /metrics"""
+
+    directory: Path
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        data = b""
+        for file in sorted(self.directory.glob("*.prom")):
+            try:
+                data += file.read_bytes()
+            except OSError:
+                pass
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_server(directory: Path, address: str, port: int) -> ThreadingHTTPServer:
+    """create a server for the metrics files in directory"""
+    handler = type("Handler", (MetricsHandler,), {"directory": directory})
+    return ThreadingHTTPServer((address, port), handler)
+
+
+if __name__ == "__main__":  # pragma: nocover
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", type=Path, required=True)
+    parser.add_argument("--address", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+
+    make_server(args.directory, args.address, args.port).serve_forever()
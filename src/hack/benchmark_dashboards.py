@@ -0,0 +1,65 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+
+# Measure the time it takes to serialize the dashboards for the cos-agent relation, which is done
+# on every refresh of the relation data. Run from the charm directory:
+#
+#   $ PYTHONPATH=lib:src python src/hack/benchmark_dashboards.py
+#
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from charms.grafana_agent.v0.cos_agent import GrafanaDashboard
+
+import cos_provider
+
+RUNS = int(os.getenv("RUNS", "10"))
+DIRS = ["src/grafana_dashboards"]
+
+
+def uncached():
+    for path in Path(DIRS[0]).glob("*"):
+        GrafanaDashboard._serialize(path.read_bytes())
+
+
+def measure(func, setup=lambda: None):
+    times = []
+    for _ in range(RUNS):
+        setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times), min(times)
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    cache_file = Path(tmp) / "dashboards.json"
+    manifest_file = Path(tmp) / "manifest.json"
+    subprocess.run(
+        [sys.executable, "src/hack/build_dashboards.py", "--output", manifest_file], check=True
+    )
+
+    def cached():
+        cos_provider.serialize_dashboards(DIRS, cache_file)
+
+    def manifest():
+        cos_provider.serialize_dashboards(DIRS, cache_file, manifest_file)
+
+    def remove_cache():
+        cache_file.unlink(missing_ok=True)
+
+    print(f"{'refresh':<32}{'median (ms)':>12}{'min (ms)':>12}")
+    for name, func, setup in (
+        ("uncached", uncached, lambda: None),
+        ("cached (cold)", cached, remove_cache),
+        ("cached (warm)", cached, lambda: None),
+        ("manifest", manifest, remove_cache),
+    ):
+        median, minimum = measure(func, setup)
+        print(f"{name:<32}{median:>12.1f}{minimum:>12.1f}")
@@ -0,0 +1,50 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+
+# Measure the time it takes to start the charm for different hooks. Every hook runs in a new
+# Python process, so the import time is paid on every dispatch. Run from the charm directory:
+#
+#   $ python src/hack/benchmark_startup.py
+#
+import os
+import statistics
+import subprocess
+import sys
+
+RUNS = int(os.getenv("RUNS", "10"))
+
+# modules used by the handlers of each hook. these are loaded on first use (see charm.py)
+HOOKS = {
+    "import only": [],
+    "update-status (worker)": ["microk8s", "kubeapi"],
+    "update-status (control-plane)": ["microk8s", "kubeapi"],
+    "update-status (control-plane, cos-agent)": ["cos_provider", "microk8s", "kubeapi"],
+    "config-changed": ["cos_provider", "containerd", "microk8s", "kubeapi"],
+    "cos-agent-relation-joined": ["cos_provider", "metrics", "microk8s", "kubeapi"],
+}
+
+SCRIPT = """
+import time
+start = time.perf_counter()
+import charm
+for module in {modules}:
+    getattr(charm, module).__name__
+print(time.perf_counter() - start)
+"""
+
+env = {**os.environ, "PYTHONPATH": "lib:src"}
+
+print(f"{'hook':<32}{'median (ms)':>12}{'min (ms)':>12}")
+for hook, modules in HOOKS.items():
+    times = []
+    for _ in range(RUNS):
+        p = subprocess.run(
+            [sys.executable, "-c", SCRIPT.format(modules=modules)],
+            env=env,
+            capture_output=True,
+            check=True,
+        )
+        times.append(float(p.stdout) * 1000)
+
+    print(f"{hook:<32}{statistics.median(times):>12.1f}{min(times):>12.1f}")
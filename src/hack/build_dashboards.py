@@ -0,0 +1,53 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+
+# Serialize the Grafana dashboards for the cos-agent relation ahead of time, so that hooks do not
+# have to compress them (see cos_provider.py). This runs when the charm is packed (see
+# charmcraft.yaml). It can also be run manually from the charm directory:
+#
+#   $ python src/hack/build_dashboards.py
+#
+# The manifest maps the path of each dashboard to the sha256 of its contents and the serialized
+# dashboard, the same as GrafanaDashboard._serialize() of the minified JSON.
+#
+# This only depends on the standard library, so that it can run in the charmcraft build
+# environment.
+
+import argparse
+import base64
+import hashlib
+import json
+import lzma
+from pathlib import Path
+
+
+def minify(raw: bytes) -> bytes:
+    """return dashboard JSON without whitespace. invalid JSON is returned unchanged"""
+    try:
+        return json.dumps(json.loads(raw), separators=(",", ":")).encode()
+    except ValueError:
+        return raw
+
+
+def build_manifest(dashboard_dirs: list) -> dict:
+    manifest = {}
+    for directory in dashboard_dirs:
+        for path in sorted(Path(directory).glob("*")):
+            raw = path.read_bytes()
+            manifest[path.as_posix()] = {
+                "sha256": hashlib.sha256(raw).hexdigest(),
+                "data": base64.b64encode(lzma.compress(minify(raw))).decode(),
+            }
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dashboards-dir", default="src/grafana_dashboards")
+    parser.add_argument("--output", type=Path, default=Path("src/dashboards_manifest.json"))
+    args = parser.parse_args()
+
+    manifest = build_manifest([args.dashboards_dir])
+    args.output.write_text(json.dumps(manifest))
+    print(f"wrote {len(manifest)} dashboards to {args.output}")
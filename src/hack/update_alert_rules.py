@@ -2,7 +2,6 @@
 # Copyright 2023 Canonical, Ltd.
 #
 import os
-import shutil
 import sys
 from urllib.request import urlopen
 
@@ -32,8 +31,11 @@ HACK_DROP_RECORDS = [
     ("kube-apiserver-availability.rules", "code_verb:apiserver_request_total:increase1h")
 ]
 
-shutil.rmtree(DIR, ignore_errors=True)
-os.mkdir(DIR)
+# remove previously generated files. rules maintained in this repository (microk8s-*.yaml) are kept
+os.makedirs(DIR, exist_ok=True)
+for file in os.listdir(DIR):
+    if not file.startswith("microk8s-"):
+        os.remove(os.path.join(DIR, file))
 
 for file in FILES:
     source = f"{SOURCE}/{file}"
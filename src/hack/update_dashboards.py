@@ -5,10 +5,19 @@
 # Sync Grafana dashboards from https://github.com/prometheus-operator/kube-prometheus
 # Dashboard changes:
 # - Remove built-in $prometheus datasource (COS adds the datasource automatically)
+# - Remove fields that Grafana recomputes on import (id, version, iteration), import metadata
+#   (__inputs, __requires), null values and empty defaults (e.g. "links": []). The dashboards are
+#   sent over the cos-agent relation, so keep them small
+# - Write compact JSON
+#
+# With --check, exit with an error if the vendored dashboards are not minified instead.
 
+import argparse
 import json
 import os
 import shutil
+import sys
+from pathlib import Path
 from urllib.request import urlopen
 
 import yaml
@@ -49,29 +58,78 @@ DASHBOARDS = [
 
 DIR = "src/grafana_dashboards"
 
-shutil.rmtree(DIR, ignore_errors=True)
-os.mkdir(DIR)
+# top-level fields recomputed by Grafana or only used when importing dashboards manually
+STRIP_FIELDS = {"id", "version", "iteration", "__inputs", "__requires"}
+
+# fields that are dropped if they match the default value
+DEFAULTS = {
+    "aliasColors": {},
+    "description": "",
+    "legendFormat": "",
+    "links": [],
+    "panels": [],
+    "rows": [],
+    "seriesOverrides": [],
+    "tags": [],
+    "thresholds": [],
+}
+
+
+def _strip_defaults(obj):
+    if isinstance(obj, dict):
+        return {
+            key: _strip_defaults(value)
+            for key, value in obj.items()
+            if value is not None and DEFAULTS.get(key, obj) != value
+        }
+    if isinstance(obj, list):
+        return [_strip_defaults(value) for value in obj]
+    return obj
+
+
+def minify(dashboard: dict) -> str:
+    # drop builtin prometheus datasource
+    for idx, val in enumerate(dashboard["templating"]["list"]):
+        if val["name"] == "datasource" and val["type"] == "datasource":
+            del dashboard["templating"]["list"][idx]
+            break
+
+    dashboard = _strip_defaults({k: v for k, v in dashboard.items() if k not in STRIP_FIELDS})
+    value = json.dumps(dashboard, separators=(",", ":"))
+
+    # COS requires $prometheusds for the datasource name
+    return value.replace("$datasource", "$prometheusds")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", action="store_true", help="check the vendored dashboards")
+    args = parser.parse_args()
 
-with urlopen(SOURCE) as request:
-    data = yaml.safe_load(request.read())
+    if args.check:
+        for path in sorted(Path(DIR).glob("*.json")):
+            if path.read_text() != minify(json.loads(path.read_text())):
+                print(f"{path} is not minified, run {sys.argv[0]}", file=sys.stderr)
+                sys.exit(1)
+        sys.exit(0)
 
-    for cm in data["items"]:
-        for key, value in cm["data"].items():
-            if key not in DASHBOARDS:
-                continue
+    shutil.rmtree(DIR, ignore_errors=True)
+    os.mkdir(DIR)
 
-            json_value = json.loads(value)
+    before, after = 0, 0
+    with urlopen(SOURCE) as request:
+        data = yaml.safe_load(request.read())
 
-            # drop builtin prometheus datasource
-            for idx, val in enumerate(json_value["templating"]["list"]):
-                if val["name"] == "datasource" and val["type"] == "datasource":
-                    del json_value["templating"]["list"][idx]
-                    break
+        for cm in data["items"]:
+            for key, value in cm["data"].items():
+                if key not in DASHBOARDS:
+                    continue
 
-            value = json.dumps(json_value, indent=4)
+                minified = minify(json.loads(value))
+                with open(f"{DIR}/{key}", "w") as fout:
+                    fout.write(minified)
 
-            # COS requires $prometheusds for the datasource name
-            value = value.replace("$datasource", "$prometheusds")
+                before, after = before + len(value), after + len(minified)
+                print(f"{key:<40}{len(value):>10}{len(minified):>10}")
 
-            with open(f"{DIR}/{key}", "w") as fout:
-                fout.write(value)
+    print(f"{'total':<40}{before:>10}{after:>10}")
@@ -0,0 +1,171 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+
+# Generate the index of metrics used by the bundled Grafana dashboards and Prometheus alert rules.
+# The index is used by metrics.py to only ingest the series that are used. Run from the charm
+# directory after updating the dashboards or alert rules:
+#
+#   $ python src/hack/update_metrics_index.py
+#
+# With --check, exit with an error if the index is not up to date instead.
+#
+# The index maps the metric names queried by the dashboards and alert rules to the job and
+# metrics_path labels they are queried with, e.g.
+#
+#   {"alert_rules": {"kubelet_node_name": [["kubelet", "/metrics"]]}, "dashboards": {...}}
+#
+# An empty label means that the metric is queried without selecting a single value, e.g. with
+# no job label or with job=~"$job".
+
+import argparse
+import json
+import re
+import sys
+from pathlib import Path
+
+import yaml
+
+DASHBOARDS_DIR = Path("src/grafana_dashboards")
+ALERT_RULES_DIR = Path("src/prometheus_alert_rules")
+INDEX = Path("src/metrics_index.json")
+
+# functions and aggregation operators are always followed by their arguments
+AGGREGATORS = {
+    "avg",
+    "bottomk",
+    "count",
+    "count_values",
+    "group",
+    "max",
+    "min",
+    "quantile",
+    "stddev",
+    "stdvar",
+    "sum",
+    "topk",
+}
+
+# keywords followed by a list of label names, e.g. "by (namespace, pod)"
+GROUPING = {"by", "without", "on", "ignoring", "group_left", "group_right"}
+
+# keywords that are not metric names
+KEYWORDS = {"and", "or", "unless", "bool", "offset", "inf", "nan"}
+
+# series that are not scraped
+SYNTHETIC = {"ALERTS", "ALERTS_FOR_STATE", "up"}
+
+TOKEN = re.compile(
+    r"""
+    (?P<comment>\#[^\n]*)
+    | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`[^`]*`)
+    | (?P<variable>\$\{[^}]*\}|\$\w+|\[\[\w+\]\])
+    | (?P<range>\[[^\]]*\])
+    | (?P<number>[0-9][0-9a-zA-Z_.]*)
+    | (?P<ident>[a-zA-Z_:][a-zA-Z0-9_:]*)
+    | (?P<selector>\{(?:"(?:[^"\\]|\\.)*"|[^}"])*\})
+    | (?P<other>\S)
+    """,
+    re.VERBOSE,
+)
+
+MATCHER = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*"((?:[^"\\]|\\.)*)"')
+
+
+def _label(matchers: list, name: str) -> list:
+    """return the values that a selector matches for a label, or [""] for any value"""
+    for label, op, value in matchers:
+        if label != name:
+            continue
+        if op == "=" and "$" not in value:
+            return [value]
+        if op == "=~" and re.fullmatch(r"[a-zA-Z0-9_/.-]+(\|[a-zA-Z0-9_/.-]+)*", value):
+            return value.split("|")
+    return [""]
+
+
+def parse(expr: str) -> set:
+    """return (metric, job, metrics_path) for each metric queried by a PromQL expression"""
+    tokens = [(m.lastgroup, m.group()) for m in TOKEN.finditer(expr)]
+    result = set()
+
+    idx = 0
+    while idx < len(tokens):
+        kind, value = tokens[idx]
+        # keywords and operators are case insensitive
+        keyword = value.lower()
+        following = tokens[idx + 1] if idx + 1 < len(tokens) else (None, None)
+        idx += 1
+
+        if kind == "ident" and keyword in GROUPING:
+            # skip list of label names
+            while following[1] == "(" and idx < len(tokens) and tokens[idx][1] != ")":
+                idx += 1
+            continue
+
+        if kind == "ident" and (
+            keyword in KEYWORDS or keyword in AGGREGATORS or following[1] == "("
+        ):
+            continue
+
+        if kind == "ident":
+            name, selector = value, following[1] if following[0] == "selector" else "{}"
+        elif kind == "selector":
+            # selector without metric name, e.g. {__name__="up"}
+            name, selector = None, value
+        else:
+            continue
+
+        matchers = MATCHER.findall(selector)
+        if name is None:
+            name = next((v for label, op, v in matchers if label == "__name__" and op == "="), "")
+        if not name or ":" in name or name in SYNTHETIC:
+            continue
+
+        for job in _label(matchers, "job"):
+            for metrics_path in _label(matchers, "metrics_path"):
+                result.add((name, job, metrics_path))
+
+    return result
+
+
+def _exprs(obj) -> list:
+    """return all PromQL expressions in a dashboard or rules file"""
+    if isinstance(obj, dict):
+        exprs = [v for k, v in obj.items() if k == "expr" and isinstance(v, str)]
+        return exprs + [e for v in obj.values() for e in _exprs(v)]
+    if isinstance(obj, list):
+        return [e for v in obj for e in _exprs(v)]
+    return []
+
+
+def _index(exprs: list) -> dict:
+    index = {}
+    for expr in exprs:
+        for name, job, metrics_path in parse(expr):
+            index.setdefault(name, set()).add((job, metrics_path))
+
+    return {name: sorted(map(list, labels)) for name, labels in sorted(index.items())}
+
+
+def build_index() -> dict:
+    dashboards, alert_rules = [], []
+    for file in sorted(DASHBOARDS_DIR.glob("*.json")):
+        dashboards.extend(_exprs(json.loads(file.read_text())))
+    for file in sorted(ALERT_RULES_DIR.glob("*.yaml")):
+        alert_rules.extend(_exprs(yaml.safe_load(file.read_text())))
+
+    return {"alert_rules": _index(alert_rules), "dashboards": _index(dashboards)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", action="store_true", help="check that the index is up to date")
+    args = parser.parse_args()
+
+    data = json.dumps(build_index(), indent=2) + "\n"
+    if not args.check:
+        INDEX.write_text(data)
+    elif not INDEX.exists() or INDEX.read_text() != data:
+        print(f"{INDEX} is out of date, run {sys.argv[0]}", file=sys.stderr)
+        sys.exit(1)
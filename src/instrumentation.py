@@ -0,0 +1,269 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+import functools
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+LOG = logging.getLogger(__name__)
+
+# rotate the journal file after it grows past this size
+JOURNAL_MAX_BYTES = 1024 * 1024
+
+# upper bounds (in seconds) of the buckets of the handler duration histogram
+HANDLER_BUCKETS = [0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+
+@dataclass
+class CommandRecord:
+    """a single execution of an external command"""
+
+    cmd: str
+    seconds: float
+    exit_code: Optional[int]
+    output_bytes: int
+
+
+@dataclass
+class RetryRecord:
+    """retries of a single call"""
+
+    name: str
+    retries: int
+    seconds: float
+    succeeded: bool
+
+
+@dataclass
+class HandlerRecord:
+    """a single run of a charm event handler"""
+
+    event: str
+    handler: str
+    seconds: float
+
+
+@dataclass
+class StatusTransition:
+    """a change of the unit status"""
+
+    source: str
+    target: str
+
+
+@dataclass
+class RelationWrite:
+    """a refresh of the data of a relation"""
+
+    relation: str
+    skipped: bool
+
+
+@dataclass
+class Report:
+    """instrumentation data collected during the current hook"""
+
+    commands: List[CommandRecord] = field(default_factory=list)
+    retries: List[RetryRecord] = field(default_factory=list)
+    handlers: List[HandlerRecord] = field(default_factory=list)
+    status_transitions: List[StatusTransition] = field(default_factory=list)
+    relation_writes: List[RelationWrite] = field(default_factory=list)
+    node_ready_wait_seconds: Optional[float] = None
+
+
+# report for the current hook. every hook runs in a new process, so this is reset per hook
+REPORT = Report()
+
+
+def command_name(cmd: List[str]) -> str:
+    """return a short name for a command to use in reports, e.g. "microk8s status" """
+    return " ".join([Path(cmd[0]).name, *cmd[1:2]])
+
+
+def record_command(cmd: str, seconds: float, exit_code: Optional[int], output_bytes: int):
+    """record the execution of an external command"""
+    REPORT.commands.append(CommandRecord(cmd, seconds, exit_code, output_bytes))
+
+
+def record_retries(name: str, retries: int, seconds: float, succeeded: bool):
+    """record the number of retries and time spent until a call succeeded or gave up"""
+    REPORT.retries.append(RetryRecord(name, retries, seconds, succeeded))
+    if retries:
+        LOG.info(
+            "%s %s after %d retries (%.2fs)",
+            name,
+            "succeeded" if succeeded else "failed",
+            retries,
+            seconds,
+        )
+
+
+def record_handler(event: str, handler: str, seconds: float):
+    """record the time spent in a charm event handler"""
+    REPORT.handlers.append(HandlerRecord(event, handler, seconds))
+
+
+def record_status_transition(source: str, target: str):
+    """record a change of the unit status, e.g. from "maintenance" to "active" """
+    REPORT.status_transitions.append(StatusTransition(source, target))
+
+
+def record_relation_write(relation: str, skipped: bool):
+    """record a refresh of relation data, skipped if the data did not change"""
+    REPORT.relation_writes.append(RelationWrite(relation, skipped))
+
+
+def record_node_ready_wait(seconds: float):
+    """record the time the charm waited for the node to become ready"""
+    REPORT.node_ready_wait_seconds = seconds
+
+
+def timed(handler):
+    """decorator for charm event handlers. records the time spent in the handler"""
+
+    @functools.wraps(handler)
+    def wrapper(self, event):
+        start = time.monotonic()
+        try:
+            return handler(self, event)
+        finally:
+            record_handler(event.handle.kind, handler.__name__, time.monotonic() - start)
+
+    return wrapper
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _update_subprocess_counters(counters: Dict[str, Dict[str, float]]):
+    """add the commands and retries of the current hook to the cumulative counters"""
+    for record in REPORT.commands:
+        c = counters.setdefault(record.cmd, {})
+        c["calls"] = c.get("calls", 0) + 1
+        c["failures"] = c.get("failures", 0) + (record.exit_code != 0)
+        c["seconds"] = c.get("seconds", 0) + record.seconds
+        c["output_bytes"] = c.get("output_bytes", 0) + record.output_bytes
+
+    for record in REPORT.retries:
+        if record.name in counters:
+            c = counters[record.name]
+            c["retries"] = c.get("retries", 0) + record.retries
+
+
+SUBPROCESS_METRICS = [
+    ("calls", "microk8s_charm_subprocess_calls_total", "External commands executed"),
+    ("failures", "microk8s_charm_subprocess_failures_total", "External commands that failed"),
+    ("seconds", "microk8s_charm_subprocess_seconds_total", "Wall time of external commands"),
+    ("output_bytes", "microk8s_charm_subprocess_output_bytes_total", "Output of commands"),
+    ("retries", "microk8s_charm_subprocess_retries_total", "Retries of failed commands"),
+]
+
+
+def render_subprocess_metrics(counters: Dict[str, Dict[str, float]]) -> str:
+    """render subprocess counters in the Prometheus text format"""
+    lines = []
+    for key, metric, help in SUBPROCESS_METRICS:
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} counter"]
+        for cmd, c in sorted(counters.items()):
+            lines.append(f'{metric}{{cmd="{_escape(cmd)}"}} {c.get(key, 0):g}')
+
+    return "\n".join(lines) + "\n"
+
+
+def _update_handler_counters(counters: dict):
+    """add the handlers, status transitions, relation writes and node ready wait time of the
+    current hook to the cumulative counters"""
+    handlers = counters.setdefault("handlers", {})
+    for record in REPORT.handlers:
+        h = handlers.setdefault(f"{record.event}/{record.handler}", {})
+        h["count"] = h.get("count", 0) + 1
+        h["sum"] = h.get("sum", 0) + record.seconds
+        buckets = h.setdefault("buckets", [0] * len(HANDLER_BUCKETS))
+        for idx, bound in enumerate(HANDLER_BUCKETS):
+            buckets[idx] += record.seconds <= bound
+
+    transitions = counters.setdefault("status_transitions", {})
+    for record in REPORT.status_transitions:
+        key = f"{record.source}/{record.target}"
+        transitions[key] = transitions.get(key, 0) + 1
+
+    writes = counters.setdefault("relation_writes", {})
+    for record in REPORT.relation_writes:
+        key = f"{record.relation}/{'skipped' if record.skipped else 'written'}"
+        writes[key] = writes.get(key, 0) + 1
+
+    if REPORT.node_ready_wait_seconds is not None:
+        counters["node_ready_wait_seconds"] = REPORT.node_ready_wait_seconds
+
+
+def render_handler_metrics(counters: dict) -> str:
+    """render handler histograms, status transitions, relation writes and node ready wait time in
+    the Prometheus text format"""
+    metric = "microk8s_charm_handler_duration_seconds"
+    lines = [f"# HELP {metric} Time spent in charm event handlers", f"# TYPE {metric} histogram"]
+    for key, h in sorted(counters.get("handlers", {}).items()):
+        event, handler = key.split("/", 1)
+        labels = f'event="{_escape(event)}",handler="{_escape(handler)}"'
+        for bound, count in zip(HANDLER_BUCKETS, h["buckets"]):
+            lines.append(f'{metric}_bucket{{{labels},le="{bound:g}"}} {count}')
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {h["count"]}')
+        lines.append(f'{metric}_sum{{{labels}}} {h["sum"]:g}')
+        lines.append(f'{metric}_count{{{labels}}} {h["count"]}')
+
+    metric = "microk8s_charm_status_transitions_total"
+    lines += [f"# HELP {metric} Changes of the unit status", f"# TYPE {metric} counter"]
+    for key, count in sorted(counters.get("status_transitions", {}).items()):
+        source, target = key.split("/", 1)
+        lines.append(f'{metric}{{from="{_escape(source)}",to="{_escape(target)}"}} {count}')
+
+    metric = "microk8s_charm_relation_writes_total"
+    lines += [f"# HELP {metric} Refreshes of relation data", f"# TYPE {metric} counter"]
+    for key, count in sorted(counters.get("relation_writes", {}).items()):
+        relation, result = key.split("/", 1)
+        lines.append(f'{metric}{{relation="{_escape(relation)}",result="{result}"}} {count}')
+
+    if "node_ready_wait_seconds" in counters:
+        metric = "microk8s_charm_node_ready_wait_seconds"
+        lines += [
+            f"# HELP {metric} Time the last status update waited for the node to become ready",
+            f"# TYPE {metric} gauge",
+            f'{metric} {counters["node_ready_wait_seconds"]:g}',
+        ]
+
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: Path, data: str):
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(data)
+    os.replace(tmp, path)
+
+
+def write_report(directory: Path, hook: str):
+    """append the report of the current hook to the journal file and update the metrics files"""
+    directory.mkdir(parents=True, exist_ok=True)
+
+    journal = directory / "journal.jsonl"
+    if journal.exists() and journal.stat().st_size > JOURNAL_MAX_BYTES:
+        os.replace(journal, directory / "journal.jsonl.1")
+
+    with journal.open("a") as fout:
+        fout.write(json.dumps({"time": time.time(), "hook": hook, **asdict(REPORT)}) + "\n")
+
+    counters_file = directory / "counters.json"
+    try:
+        counters = json.loads(counters_file.read_text())
+    except (OSError, ValueError):
+        counters = {}
+
+    _update_subprocess_counters(counters.setdefault("subprocess", {}))
+    _update_handler_counters(counters)
+    _write_atomic(counters_file, json.dumps(counters))
+    _write_atomic(directory / "subprocess.prom", render_subprocess_metrics(counters["subprocess"]))
+    _write_atomic(directory / "handlers.prom", render_handler_metrics(counters))
@@ -0,0 +1,222 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+import base64
+import functools
+import http.client
+import json
+import logging
+import os
+import ssl
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import yaml
+
+LOG = logging.getLogger(__name__)
+
+# parse YAML with libyaml if available, which is much faster than the pure Python loader
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# field manager used for server-side apply
+FIELD_MANAGER = "microk8s-charm"
+
+# kind -> (resource, namespaced) for the resources applied by the charm
+RESOURCES = {
+    "ClusterRole": ("clusterroles", False),
+    "ClusterRoleBinding": ("clusterrolebindings", False),
+    "ConfigMap": ("configmaps", True),
+    "DaemonSet": ("daemonsets", True),
+    "Deployment": ("deployments", True),
+    "Namespace": ("namespaces", False),
+    "Role": ("roles", True),
+    "RoleBinding": ("rolebindings", True),
+    "Secret": ("secrets", True),
+    "Service": ("services", True),
+    "ServiceAccount": ("serviceaccounts", True),
+    "StatefulSet": ("statefulsets", True),
+}
+
+
+class KubernetesError(Exception):
+    """error response from the Kubernetes API server"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+def _load_cert_chain(context: ssl.SSLContext, user: dict):
+    """load client certificate and key from kubeconfig user. inline data is written to temporary
+    files, since the ssl module can only load certificates from disk"""
+    cert, key = user.get("client-certificate"), user.get("client-key")
+    cert_data, key_data = user.get("client-certificate-data"), user.get("client-key-data")
+
+    if cert and key:
+        context.load_cert_chain(cert, key)
+    elif cert_data and key_data:
+        with tempfile.TemporaryDirectory() as tmp:
+            cert, key = Path(tmp) / "client.crt", Path(tmp) / "client.key"
+            cert.write_bytes(base64.b64decode(cert_data))
+            key.write_bytes(base64.b64decode(key_data))
+            os.chmod(key, 0o600)
+            context.load_cert_chain(cert, key)
+
+
+class Client:
+    """minimal Kubernetes API client. A single HTTPS connection is kept open and reused for all
+    requests, so that the TLS handshake happens once"""
+
+    def __init__(self, kubeconfig: Path, timeout: float = 10):
+        """create a client from a kubeconfig file. raises OSError if the file cannot be read and
+        ValueError if it is not valid"""
+        try:
+            config = yaml.load(kubeconfig.read_text(), Loader=YAML_LOADER)
+            context_name = config["current-context"]
+            context = next(c["context"] for c in config["contexts"] if c["name"] == context_name)
+            cluster = next(
+                c["cluster"] for c in config["clusters"] if c["name"] == context["cluster"]
+            )
+            user = next(u["user"] for u in config["users"] if u["name"] == context["user"])
+        except (yaml.YAMLError, KeyError, TypeError, StopIteration) as e:
+            raise ValueError(f"invalid kubeconfig {kubeconfig}: {e!r}") from e
+
+        url = urlsplit(cluster["server"])
+        self._host = url.hostname
+        self._port = url.port or 443
+        self._timeout = timeout
+        self._headers = {"Accept": "application/json"}
+        if user.get("token"):
+            self._headers["Authorization"] = f"Bearer {user['token']}"
+
+        self._context = ssl.create_default_context()
+        if cluster.get("certificate-authority-data"):
+            ca_data = base64.b64decode(cluster["certificate-authority-data"]).decode()
+            self._context.load_verify_locations(cadata=ca_data)
+        elif cluster.get("certificate-authority"):
+            self._context.load_verify_locations(cafile=cluster["certificate-authority"])
+        if cluster.get("insecure-skip-tls-verify"):
+            self._context.check_hostname = False
+            self._context.verify_mode = ssl.CERT_NONE
+
+        _load_cert_chain(self._context, user)
+
+        self._conn: Optional[http.client.HTTPSConnection] = None
+
+    def close(self):
+        """close the underlying connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _request(self, method: str, path: str, body: Optional[bytes], headers: Dict[str, str]):
+        if self._conn is None:
+            self._conn = http.client.HTTPSConnection(
+                self._host, self._port, timeout=self._timeout, context=self._context
+            )
+
+        try:
+            self._conn.request(method, path, body=body, headers={**self._headers, **headers})
+            response = self._conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+
+    def _request_with_reconnect(self, method, path, body, headers):
+        try:
+            return self._request(method, path, body, headers)
+        except (ConnectionError, http.client.HTTPException):
+            # the server may close idle connections, try once more on a new connection
+            try:
+                return self._request(method, path, body, headers)
+            except http.client.HTTPException as e:
+                raise ConnectionError(f"request {method} {path} failed: {e!r}") from e
+
+    def request(
+        self, method: str, path: str, body: Optional[dict] = None, content_type=None
+    ) -> dict:
+        """send a request to the API server and return the decoded response. raises OSError if
+        the API server cannot be reached and KubernetesError for error responses"""
+        LOG.debug("Kubernetes API request %s %s", method, path)
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": content_type or "application/json"} if data else {}
+
+        status, response = self._request_with_reconnect(method, path, data, headers)
+        if status >= 400:
+            try:
+                message = json.loads(response)["message"]
+            except (ValueError, KeyError, TypeError):
+                message = response.decode(errors="replace")
+            raise KubernetesError(status, message)
+
+        return json.loads(response) if response else {}
+
+    def probe(self, path: str) -> bool:
+        """check a health endpoint of the API server, e.g. /readyz. returns True if healthy.
+        raises OSError if the API server cannot be reached and KubernetesError if the endpoint
+        cannot be accessed"""
+        status, response = self._request_with_reconnect("GET", path, None, {})
+        if status in (401, 403, 404):
+            raise KubernetesError(status, response.decode(errors="replace"))
+
+        return status == 200
+
+    def get(self, path: str) -> dict:
+        """GET an object"""
+        return self.request("GET", path)
+
+    def create(self, path: str, obj: dict) -> dict:
+        """POST a new object to a collection"""
+        return self.request("POST", path, obj)
+
+    def delete(self, path: str):
+        """DELETE an object. objects that do not exist are ignored"""
+        try:
+            self.request("DELETE", path)
+        except KubernetesError as e:
+            if e.status != 404:
+                raise
+
+    def apply(self, obj: dict) -> dict:
+        """server-side apply of an object"""
+        return self.request(
+            "PATCH",
+            f"{object_path(obj)}?fieldManager={FIELD_MANAGER}&force=true",
+            obj,
+            content_type="application/apply-patch+yaml",
+        )
+
+    def apply_manifest(self, manifest: Path):
+        """server-side apply all objects of a YAML manifest"""
+        for obj in load_manifest(manifest):
+            self.apply(obj)
+
+
+def load_manifest(manifest: Path) -> List[dict]:
+    """return the objects of a YAML manifest"""
+    return [obj for obj in yaml.load_all(manifest.read_text(), Loader=YAML_LOADER) if obj]
+
+
+def object_path(obj: dict) -> str:
+    """return the API path of a Kubernetes object"""
+    api_version, kind = obj["apiVersion"], obj["kind"]
+    try:
+        resource, namespaced = RESOURCES[kind]
+    except KeyError:
+        raise ValueError(f"unknown resource kind {kind}") from None
+
+    path = f"/api/{api_version}" if "/" not in api_version else f"/apis/{api_version}"
+    if namespaced:
+        path += f"/namespaces/{obj['metadata'].get('namespace', 'default')}"
+
+    return f"{path}/{resource}/{obj['metadata']['name']}"
+
+
+@functools.lru_cache(maxsize=None)
+def get_client(kubeconfig: Path) -> Client:
+    """return a client for a kubeconfig file. clients are cached, so that connections are
+    reused for the whole hook"""
+    return Client(kubeconfig)
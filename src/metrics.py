@@ -5,109 +5,585 @@
 
 import json
 import logging
-import subprocess
-from base64 import b64decode
-from typing import Dict, List, Tuple
+import re
+from base64 import b64decode, b64encode
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
+import kubeapi
 import microk8s
 import util
 
 LOG = logging.getLogger(__name__)
 
+# name of the kube-system secret with the TLS client certificate for the metrics endpoints
+TLS_SECRET_NAME = "microk8s-observability-tls"
 
-def apply_required_resources():
-    """kubectl apply manifests that create the required roles and RBAC rules for observability"""
-    for file in ["metrics.yaml", "kube-state-metrics.yaml"]:
-        path = util.charm_dir() / "src" / "deploy" / file
-        util.ensure_call(["microk8s", "kubectl", "apply", "-f", path.as_posix()])
+# kube-state-metrics endpoints. "proxy" scrapes through the apiserver service proxy, "nodeport"
+# scrapes kube-state-metrics directly through a NodePort service, using TLS client auth
+KUBE_STATE_METRICS_ENDPOINTS = ["proxy", "nodeport"]
+KUBE_STATE_METRICS_NODE_PORT = 31880
+# kube-state-metrics can be sharded across the replicas of a StatefulSet. with "nodeport", each
+# shard is exposed on its own node port, starting from KUBE_STATE_METRICS_NODE_PORT
+KUBE_STATE_METRICS_MAX_SHARDS = 16
+KUBE_STATE_METRICS_TLS_SECRET_NAME = "kube-state-metrics-tls"
+KUBE_STATE_METRICS_TLS_DIR = "/etc/kube-state-metrics"
+
+# kubelite runs all Kubernetes services in a single process, so the apiserver endpoint exposes the
+# metrics of kube-scheduler and kube-controller-manager, and the kubelet endpoint the metrics of
+# kube-proxy. each endpoint is scraped once, and metric families are routed to the job of their
+# component by name. process-wide families (e.g. process_*, go_*, rest_client_*, workqueue_*) stay
+# in the job of the endpoint, and are copied to the other jobs by the recording rules in
+# src/prometheus_alert_rules/microk8s-kubelite.yaml
+CONTROL_PLANE_JOB_PREFIXES = {
+    "kube-scheduler": ["scheduler"],
+    "kube-controller-manager": [
+        "attachdetach_controller",
+        "cronjob_controller",
+        "endpoint_slice_controller",
+        "endpoint_slice_mirroring_controller",
+        "ephemeral_volume_controller",
+        "garbagecollector_controller",
+        "job_controller",
+        "node_collector",
+        "node_ipam_controller",
+        "pv_collector",
+        "replicaset_controller",
+        "root_ca_cert_publisher",
+        "service_controller",
+        "taint_eviction_controller",
+        "ttl_after_finished_controller",
+    ],
+}
+KUBELET_JOB_PREFIXES = {
+    "kube-proxy": ["kubeproxy"],
+}
+
+# metrics profiles, from the most to the least series ingested:
+# - "full" ingests all series
+# - "standard" ingests the series used by the bundled dashboards and alert rules
+# - "minimal" ingests the series used by the bundled alert rules only
+METRICS_PROFILES = ["full", "standard", "minimal"]
+
+# index of the metrics used by the bundled dashboards and alert rules, with the job and
+# metrics_path labels they are queried with. generated by src/hack/update_metrics_index.py
+METRICS_INDEX = "metrics_index.json"
+
+# job and metrics_path labels of the series ingested by each scrape job
+SCRAPE_JOB_LABELS = {
+    "apiserver": (["apiserver", "kube-controller-manager", "kube-scheduler"], ""),
+    "kube-state-metrics": (["kube-state-metrics"], ""),
+    "kubelet": (["kubelet", "kube-proxy"], "/metrics"),
+    "kubelet-cadvisor": (["kubelet"], "/metrics/cadvisor"),
+    "kubelet-probes": (["kubelet"], "/metrics/probes"),
+}
+
+# scrape job of each family of metrics endpoints with a configurable scrape interval and timeout.
+# kube-proxy metrics are scraped with the kubelet (see KUBELET_JOB_PREFIXES)
+SCRAPE_FAMILIES = {
+    "apiserver": "apiserver",
+    "kube-state-metrics": "kube-state-metrics",
+    "kubelet": "kubelet",
+    "cadvisor": "kubelet-cadvisor",
+    "probes": "kubelet-probes",
+}
+
+# scrape interval and timeout of jobs that do not set them (same as Prometheus and grafana-agent)
+DEFAULT_SCRAPE_INTERVAL = "1m"
+DEFAULT_SCRAPE_TIMEOUT = "10s"
+
+# systemd service serving the charm instrumentation metrics (see exporter.py)
+EXPORTER_SERVICE = "microk8s-charm-exporter"
+EXPORTER_PORT = 19380
+
+
+def _client() -> kubeapi.Client:
+    """return a Kubernetes API client with admin credentials"""
+    return kubeapi.get_client(microk8s.snap_data_dir() / "credentials" / "client.config")
+
+
+def _kube_state_metrics_node_ports(shards: int) -> Dict[str, int]:
+    """return the names and node ports of the kube-state-metrics NodePort services"""
+    if shards == 1:
+        return {"kube-state-metrics-nodeport": KUBE_STATE_METRICS_NODE_PORT}
+
+    return {
+        f"kube-state-metrics-shard-{i}": KUBE_STATE_METRICS_NODE_PORT + i for i in range(shards)
+    }
+
+
+def kube_state_metrics_resources(endpoint: str, shards: int) -> List[Dict]:
+    """return the kube-state-metrics resources for the configured endpoint and shards. for
+    "nodeport", kube-state-metrics serves metrics over TLS and only accepts client certificates
+    signed by the cluster CA. with more than one shard, kube-state-metrics is deployed as a
+    StatefulSet and each replica serves the shard of its ordinal"""
+    objs = kubeapi.load_manifest(util.charm_dir() / "src" / "deploy" / "kube-state-metrics.yaml")
+    deployment = next(obj for obj in objs if obj["kind"] == "Deployment")
+    pod = deployment["spec"]["template"]["spec"]
+    container = pod["containers"][0]
+
+    if endpoint == "nodeport":
+        pod["volumes"] = [
+            {"name": "tls", "secret": {"secretName": KUBE_STATE_METRICS_TLS_SECRET_NAME}}
+        ]
+        container["args"] = [f"--tls-config={KUBE_STATE_METRICS_TLS_DIR}/web-config.yaml"]
+        container["volumeMounts"] = [
+            {"name": "tls", "mountPath": KUBE_STATE_METRICS_TLS_DIR, "readOnly": True}
+        ]
+        # probes cannot present a client certificate
+        for probe, port in (("livenessProbe", 8080), ("readinessProbe", 8081)):
+            container[probe] = {
+                "tcpSocket": {"port": port},
+                "initialDelaySeconds": 5,
+                "timeoutSeconds": 5,
+            }
+
+        for idx, (name, node_port) in enumerate(_kube_state_metrics_node_ports(shards).items()):
+            selector = {"app.kubernetes.io/name": "kube-state-metrics"}
+            if shards > 1:
+                selector["statefulset.kubernetes.io/pod-name"] = f"kube-state-metrics-{idx}"
+
+            objs.append(
+                {
+                    "apiVersion": "v1",
+                    "kind": "Service",
+                    "metadata": {"name": name, "namespace": "kube-system"},
+                    "spec": {
+                        "type": "NodePort",
+                        "ports": [
+                            {
+                                "name": "http-metrics",
+                                "port": 8080,
+                                "targetPort": "http-metrics",
+                                "nodePort": node_port,
+                            }
+                        ],
+                        "selector": selector,
+                    },
+                }
+            )
+
+    if shards == 1:
+        return objs
+
+    # automatic sharding, see https://github.com/kubernetes/kube-state-metrics#automated-sharding
+    container["args"] = container.get("args", []) + [
+        "--pod=$(POD_NAME)",
+        "--pod-namespace=$(POD_NAMESPACE)",
+    ]
+    container["env"] = [
+        {"name": "POD_NAME", "valueFrom": {"fieldRef": {"fieldPath": "metadata.name"}}},
+        {"name": "POD_NAMESPACE", "valueFrom": {"fieldRef": {"fieldPath": "metadata.namespace"}}},
+    ]
+    objs[objs.index(deployment)] = {
+        "apiVersion": "apps/v1",
+        "kind": "StatefulSet",
+        "metadata": deployment["metadata"],
+        "spec": {**deployment["spec"], "replicas": shards, "serviceName": "kube-state-metrics"},
+    }
+
+    # kube-state-metrics finds its shard from its pod and StatefulSet
+    metadata = {"name": "kube-state-metrics", "namespace": "kube-system"}
+    objs.append(
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "Role",
+            "metadata": metadata,
+            "rules": [
+                {"apiGroups": [""], "resources": ["pods"], "verbs": ["get"]},
+                {
+                    "apiGroups": ["apps"],
+                    "resources": ["statefulsets"],
+                    "resourceNames": ["kube-state-metrics"],
+                    "verbs": ["get"],
+                },
+            ],
+        }
+    )
+    objs.append(
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "RoleBinding",
+            "metadata": metadata,
+            "roleRef": {
+                "apiGroup": "rbac.authorization.k8s.io",
+                "kind": "Role",
+                "name": "kube-state-metrics",
+            },
+            "subjects": [{"kind": "ServiceAccount", **metadata}],
+        }
+    )
+
+    # shards are scraped through the apiserver pod proxy with the "proxy" endpoint
+    metadata = {"name": "microk8s-observability-kube-state-metrics", "namespace": "kube-system"}
+    objs.append(
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "Role",
+            "metadata": metadata,
+            "rules": [
+                {
+                    "apiGroups": [""],
+                    "resources": ["pods/proxy"],
+                    "resourceNames": [f"kube-state-metrics-{i}:8080" for i in range(shards)],
+                    "verbs": ["get"],
+                }
+            ],
+        }
+    )
+    objs.append(
+        {
+            "apiVersion": "rbac.authorization.k8s.io/v1",
+            "kind": "RoleBinding",
+            "metadata": metadata,
+            "roleRef": {"apiGroup": "rbac.authorization.k8s.io", "kind": "Role", **metadata},
+            "subjects": [
+                {
+                    "kind": "ServiceAccount",
+                    "name": "microk8s-observability",
+                    "namespace": "kube-system",
+                }
+            ],
+        }
+    )
+    return objs
+
+
+def _ensure_kube_state_metrics_tls(client: kubeapi.Client):
+    """create the secret with the kube-state-metrics serving certificate, if it does not exist"""
+    try:
+        client.get(f"/api/v1/namespaces/kube-system/secrets/{KUBE_STATE_METRICS_TLS_SECRET_NAME}")
+        return
+    except kubeapi.KubernetesError as e:
+        if e.status != 404:
+            raise
+
+    LOG.info("Creating TLS certificate for kube-state-metrics")
+
+    key_path = util.charm_dir() / "kube-state-metrics.key"
+    crt_path = util.charm_dir() / "kube-state-metrics.crt"
+    _sign_certificate("/CN=kube-state-metrics", key_path, crt_path)
+
+    web_config = f"""tls_server_config:
+  cert_file: {KUBE_STATE_METRICS_TLS_DIR}/tls.crt
+  key_file: {KUBE_STATE_METRICS_TLS_DIR}/tls.key
+  client_auth_type: RequireAndVerifyClientCert
+  client_ca_file: {KUBE_STATE_METRICS_TLS_DIR}/ca.crt
+"""
+    ca_path = microk8s.snap_data_dir() / "certs" / "ca.crt"
+    client.create(
+        "/api/v1/namespaces/kube-system/secrets",
+        {
+            "apiVersion": "v1",
+            "kind": "Secret",
+            "metadata": {"name": KUBE_STATE_METRICS_TLS_SECRET_NAME, "namespace": "kube-system"},
+            "data": {
+                "tls.crt": b64encode(crt_path.read_bytes()).decode(),
+                "tls.key": b64encode(key_path.read_bytes()).decode(),
+                "ca.crt": b64encode(ca_path.read_bytes()).decode(),
+                "web-config.yaml": b64encode(web_config.encode()).decode(),
+            },
+        },
+    )
+
+
+def _apply_kube_state_metrics(client: kubeapi.Client, endpoint: str, shards: int):
+    if endpoint == "nodeport":
+        _ensure_kube_state_metrics_tls(client)
+
+    for obj in kube_state_metrics_resources(endpoint, shards):
+        client.apply(obj)
+
+    # remove resources of a previous endpoint or number of shards
+    if shards == 1:
+        client.delete("/apis/apps/v1/namespaces/kube-system/statefulsets/kube-state-metrics")
+    else:
+        client.delete("/apis/apps/v1/namespaces/kube-system/deployments/kube-state-metrics")
+
+    services = {
+        **_kube_state_metrics_node_ports(1),
+        **_kube_state_metrics_node_ports(KUBE_STATE_METRICS_MAX_SHARDS),
+    }
+    if endpoint == "nodeport":
+        services = services.keys() - _kube_state_metrics_node_ports(shards).keys()
+    for name in sorted(services):
+        client.delete(f"/api/v1/namespaces/kube-system/services/{name}")
+
+
+def apply_required_resources(kube_state_metrics_endpoint: str, kube_state_metrics_shards: int):
+    """apply manifests that create the required roles and RBAC rules for observability"""
+    client = _client()
+    path = util.charm_dir() / "src" / "deploy" / "metrics.yaml"
+    util.ensure_func(client.apply_manifest, [path], {}, retry_on=(OSError, kubeapi.KubernetesError))
+    util.ensure_func(
+        _apply_kube_state_metrics,
+        [client, kube_state_metrics_endpoint, kube_state_metrics_shards],
+        {},
+        retry_on=(OSError, kubeapi.KubernetesError),
+    )
+
+
+def _exporter_unit_file() -> Path:
+    return Path("/etc/systemd/system") / f"{EXPORTER_SERVICE}.service"
+
+
+def install_exporter(restart: bool = False):
+    """install and start the systemd service that serves the charm instrumentation metrics.
+    the service is restarted if `restart` is set, e.g. to pick up a new charm revision"""
+    exporter = util.charm_dir() / "src" / "exporter.py"
+    directory = util.charm_dir() / "instrumentation"
+    unit = f"""[Unit]
+Description=MicroK8s charm metrics exporter
+After=network.target
+
+[Service]
+ExecStart=/usr/bin/python3 {exporter} --directory {directory} --port {EXPORTER_PORT}
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+"""
+    if util.ensure_file(_exporter_unit_file(), unit, 0o644, 0, 0):
+        util.ensure_call(["systemctl", "daemon-reload"])
+        util.ensure_call(["systemctl", "enable", "--now", EXPORTER_SERVICE])
+    elif restart:
+        util.ensure_call(["systemctl", "restart", EXPORTER_SERVICE])
+
+
+def remove_exporter():
+    """stop and remove the systemd service that serves the charm instrumentation metrics"""
+    util.run(["systemctl", "disable", "--now", EXPORTER_SERVICE], check=False)
+    _exporter_unit_file().unlink(missing_ok=True)
+
+
+def _sign_certificate(subject: str, key_path: Path, crt_path: Path):
+    """create a private key and a certificate signed by the cluster CA"""
+    # private key
+    util.ensure_call(["openssl", "genrsa", "-out", key_path.as_posix(), "2048"])
+
+    # csr
+    p = util.ensure_call(
+        [
+            "openssl",
+            "req",
+            "-new",
+            "-subj",
+            subject,
+            "-key",
+            key_path.as_posix(),
+        ],
+        capture_output=True,
+    )
+    csr = p.stdout
+
+    # sign certificate
+    util.ensure_call(
+        [
+            "openssl",
+            "x509",
+            "-req",
+            "-sha256",
+            "-CA",
+            (microk8s.snap_data_dir() / "certs" / "ca.crt").as_posix(),
+            "-CAkey",
+            (microk8s.snap_data_dir() / "certs" / "ca.key").as_posix(),
+            "-CAcreateserial",
+            "-days",
+            "3650",
+            "-out",
+            crt_path.as_posix(),
+        ],
+        input=csr,
+    )
 
 
 def get_tls_auth() -> Tuple[str, str]:
     """return (cert, key) to use for TLS client auth on the metrics endpoints"""
+    client = _client()
     try:
-        p = util.run(
-            [
-                "microk8s",
-                "kubectl",
-                "get",
-                "secret",
-                "--namespace=kube-system",
-                "microk8s-observability-tls",
-                "-o=json",
-            ],
-            capture_output=True,
-        )
-        output = json.loads(p.stdout)["data"]
+        secret = client.get(f"/api/v1/namespaces/kube-system/secrets/{TLS_SECRET_NAME}")
+        output = secret["data"]
         return (b64decode(output["tls.crt"]).decode(), b64decode(output["tls.key"]).decode())
 
-    except (json.JSONDecodeError, KeyError, TypeError, ValueError, subprocess.CalledProcessError):
+    except (OSError, kubeapi.KubernetesError, KeyError, TypeError, ValueError):
         # could not retrieve secret, or it contains invalid data. create it
 
         LOG.info("Creating TLS auth for ServiceAccount microk8s-observability")
 
         key_path = util.charm_dir() / "metrics.key"
         crt_path = util.charm_dir() / "metrics.crt"
-
-        # private key
-        util.ensure_call(["openssl", "genrsa", "-out", key_path.as_posix(), "2048"])
-
-        # csr
-        p = util.ensure_call(
-            [
-                "openssl",
-                "req",
-                "-new",
-                "-subj",
-                "/CN=system:serviceaccount:kube-system:microk8s-observability",
-                "-key",
-                key_path.as_posix(),
-            ],
-            capture_output=True,
-        )
-        csr = p.stdout
-
-        # sign certificate
-        util.ensure_call(
-            [
-                "openssl",
-                "x509",
-                "-req",
-                "-sha256",
-                "-CA",
-                (microk8s.snap_data_dir() / "certs" / "ca.crt").as_posix(),
-                "-CAkey",
-                (microk8s.snap_data_dir() / "certs" / "ca.key").as_posix(),
-                "-CAcreateserial",
-                "-days",
-                "3650",
-                "-out",
-                crt_path.as_posix(),
-            ],
-            input=csr,
+        _sign_certificate(
+            "/CN=system:serviceaccount:kube-system:microk8s-observability", key_path, crt_path
         )
 
         # create Kubernetes secret
-        util.ensure_call(
-            [
-                "microk8s",
-                "kubectl",
-                "create",
-                "secret",
-                "tls",
-                "microk8s-observability-tls",
-                "--namespace=kube-system",
-                "--cert",
-                crt_path.as_posix(),
-                "--key",
-                key_path.as_posix(),
-            ]
+        secret = {
+            "apiVersion": "v1",
+            "kind": "Secret",
+            "type": "kubernetes.io/tls",
+            "metadata": {"name": TLS_SECRET_NAME, "namespace": "kube-system"},
+            "data": {
+                "tls.crt": b64encode(crt_path.read_bytes()).decode(),
+                "tls.key": b64encode(key_path.read_bytes()).decode(),
+            },
+        }
+        util.ensure_func(
+            client.create,
+            ["/api/v1/namespaces/kube-system/secrets", secret],
+            {},
+            retry_on=(OSError, kubeapi.KubernetesError),
         )
 
         return get_tls_auth()
 
 
-def build_scrape_jobs(cert: str, key: str, control_plane: bool, hostname: str) -> List[Dict]:
-    """build scrape jobs for worker nodes (kubelet and kube-proxy)"""
+def _parse_duration(duration: str) -> float:
+    """parse a Prometheus duration, e.g. "1m30s", into seconds. units are y, w, d, h, m, s and ms,
+    from the largest to the smallest. raises ValueError if invalid"""
+    match = re.fullmatch(
+        r"(?:(\d+)y)?(?:(\d+)w)?(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m(?!s))?(?:(\d+)s)?(?:(\d+)ms)?",
+        duration,
+    )
+    if not duration or not match:
+        raise ValueError(f"invalid duration '{duration}'")
+
+    years, weeks, days, hours, minutes, seconds, millis = (int(v or 0) for v in match.groups())
+    days += years * 365 + weeks * 7
+    return days * 86400 + hours * 3600 + minutes * 60 + seconds + millis / 1000
+
+
+def parse_scrape_intervals(json_str: str) -> Dict[str, Dict[str, str]]:
+    """parse the scrape interval and timeout of each family of metrics endpoints from a JSON
+    string, e.g. '{"cadvisor": {"interval": "2m", "timeout": "90s"}}'. returns the
+    "scrape_interval" and "scrape_timeout" of each scrape job. raises ValueError if the
+    configuration is not valid"""
+    try:
+        parsed = json.loads(json_str or "{}")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"not valid JSON: {e}") from e
+
+    if not isinstance(parsed, dict):
+        raise ValueError("must be a JSON object")
+
+    result = {}
+    for family, config in parsed.items():
+        if family not in SCRAPE_FAMILIES:
+            raise ValueError(f"unknown family '{family}', must be one of {list(SCRAPE_FAMILIES)}")
+        if not isinstance(config, dict) or set(config) - {"interval", "timeout"}:
+            raise ValueError(f"{family}: must be an object with 'interval' and 'timeout'")
+
+        interval = config.get("interval", DEFAULT_SCRAPE_INTERVAL)
+        if not isinstance(interval, str):
+            raise ValueError(f"{family}: interval and timeout must be strings")
+
+        # as in Prometheus, the default timeout is capped to the interval
+        timeout = config.get("timeout")
+        if timeout is None:
+            timeout = DEFAULT_SCRAPE_TIMEOUT
+            if _parse_duration(interval) < _parse_duration(timeout):
+                timeout = interval
+        if not isinstance(timeout, str):
+            raise ValueError(f"{family}: interval and timeout must be strings")
+
+        if _parse_duration(timeout) <= 0:
+            raise ValueError(f"{family}: timeout must be positive")
+        if _parse_duration(timeout) > _parse_duration(interval):
+            raise ValueError(f"{family}: timeout {timeout} must not exceed interval {interval}")
+
+        result[SCRAPE_FAMILIES[family]] = {"scrape_interval": interval, "scrape_timeout": timeout}
+
+    return result
+
+
+def _route_jobs(job_prefixes: Dict[str, List[str]]) -> List[Dict]:
+    """metric relabel configs that set the job label of metrics by their name prefix"""
+    return [
+        {
+            "source_labels": ["__name__"],
+            "regex": f"({'|'.join(prefixes)})_.+",
+            "target_label": "job",
+            "replacement": job_name,
+        }
+        for job_name, prefixes in job_prefixes.items()
+    ]
+
+
+def _profile_rules(index: Dict, job_name: str, profile: str) -> Optional[List[Dict]]:
+    """metric relabel configs that only keep the series of a job used by the metrics profile.
+    returns None if the profile uses no series of the job"""
+    if profile == "full":
+        return []
+
+    jobs, metrics_path = SCRAPE_JOB_LABELS[job_name]
+    sources = ["alert_rules"] if profile == "minimal" else ["alert_rules", "dashboards"]
+    names, selected = set(), False
+    for source in sources:
+        for name, labels in index[source].items():
+            for job, path in labels:
+                if job in ("", *jobs) and path in ("", metrics_path):
+                    names.add(name)
+                    # metrics queried without a job label do not require scraping the job
+                    selected = selected or job != ""
+
+    if not selected:
+        return None
+
+    return [{"source_labels": ["__name__"], "regex": "|".join(sorted(names)), "action": "keep"}]
+
+
+def _kube_state_metrics_job(base_job: Dict, endpoint: str, shards: int) -> Dict:
+    """build the kube-state-metrics scrape job. shards are scraped as separate targets"""
+    job = {
+        **base_job,
+        "job_name": "kube-state-metrics",
+        "relabel_configs": [{"target_label": "job", "replacement": "kube-state-metrics"}],
+    }
+    proxy = "/api/v1/namespaces/kube-system"
+
+    if endpoint == "nodeport":
+        # scraped directly
+        job["static_configs"] = [
+            {
+                "targets": [f"localhost:{node_port}"],
+                **({"labels": {"shard": str(i)}} if shards > 1 else {}),
+            }
+            for i, node_port in enumerate(_kube_state_metrics_node_ports(shards).values())
+        ]
+    elif shards == 1:
+        # scraped through the apiserver service proxy
+        job["metrics_path"] = f"{proxy}/services/kube-state-metrics:http-metrics/proxy/metrics"
+        job["static_configs"] = [{"targets": ["localhost:16443"]}]
+    else:
+        # shards scraped through the apiserver pod proxy
+        job["static_configs"] = [
+            {
+                "targets": ["localhost:16443"],
+                "labels": {
+                    "__metrics_path__": f"{proxy}/pods/kube-state-metrics-{i}:8080/proxy/metrics",
+                    "shard": str(i),
+                },
+            }
+            for i in range(shards)
+        ]
+
+    return job
+
+
+def build_scrape_jobs(
+    cert: str,
+    key: str,
+    control_plane: bool,
+    hostname: str,
+    kube_state_metrics: bool,
+    kube_state_metrics_endpoint: str = "proxy",
+    kube_state_metrics_shards: int = 1,
+    metrics_profile: str = "full",
+    scrape_intervals: Optional[Dict[str, Dict[str, str]]] = None,
+) -> List[Dict]:
+    """build scrape jobs for worker nodes (kubelet and kube-proxy). kube-state-metrics reports
+    cluster-wide state, so it should only be scraped by a single control plane unit. the metrics
+    profile (see METRICS_PROFILES) selects the series that are ingested. scrape_intervals is the
+    scrape interval and timeout of each job (see parse_scrape_intervals)"""
     base_job = {
         "scheme": "https",
         "tls_config": {
@@ -117,58 +593,73 @@ def build_scrape_jobs(cert: str, key: str, control_plane: bool, hostname: str) -
         },
     }
 
+    index = {}
+    if metrics_profile != "full":
+        index = json.loads((util.charm_dir() / "src" / METRICS_INDEX).read_text())
+
     scrape_jobs = []
 
     if control_plane:
         # apiserver, kube-scheduler, kube-controller-manager
-        for job_name in ["apiserver", "kube-scheduler", "kube-controller-manager"]:
-            scrape_jobs.append(
-                {
-                    **base_job,
-                    "job_name": job_name,
-                    "static_configs": [{"targets": ["localhost:16443"]}],
-                    "relabel_configs": [{"target_label": "job", "replacement": job_name}],
-                }
-            )
-
-        # kube-state-metrics
+        rules = _profile_rules(index, "apiserver", metrics_profile) or []
         scrape_jobs.append(
             {
                 **base_job,
-                "job_name": "kube-state-metrics",
-                "metrics_path": "/api/v1/namespaces/kube-system/services/kube-state-metrics:http-metrics/proxy/metrics",  # noqa
-                "relabel_configs": [{"target_label": "job", "replacement": "kube-state-metrics"}],
+                "job_name": "apiserver",
                 "static_configs": [{"targets": ["localhost:16443"]}],
+                "relabel_configs": [{"target_label": "job", "replacement": "apiserver"}],
+                "metric_relabel_configs": rules + _route_jobs(CONTROL_PLANE_JOB_PREFIXES),
             }
         )
 
-    # kube-proxy
-    scrape_jobs.append(
-        {
-            **base_job,
-            "job_name": "kube-proxy",
-            "static_configs": [{"targets": ["localhost:10250"]}],
-            "relabel_configs": [{"target_label": "job", "replacement": "kube-proxy"}],
-        }
-    )
+    if control_plane and kube_state_metrics:
+        job = _kube_state_metrics_job(
+            base_job, kube_state_metrics_endpoint, kube_state_metrics_shards
+        )
+        if rules := _profile_rules(index, "kube-state-metrics", metrics_profile):
+            job["metric_relabel_configs"] = rules
+        scrape_jobs.append(job)
 
-    # kubelet
+    # kubelet, kube-proxy
     for job_name, metrics_path in (
         ("kubelet", "/metrics"),
         ("kubelet-cadvisor", "/metrics/cadvisor"),
         ("kubelet-probes", "/metrics/probes"),
     ):
-        scrape_jobs.append(
-            {
-                **base_job,
-                "job_name": job_name,
-                "metrics_path": metrics_path,
-                "static_configs": [{"targets": ["localhost:10250"], "labels": {"node": hostname}}],
-                "relabel_configs": [
-                    {"target_label": "metrics_path", "replacement": metrics_path},
-                    {"target_label": "job", "replacement": "kubelet"},
-                ],
-            }
-        )
+        rules = _profile_rules(index, job_name, metrics_profile)
+        if rules is None:
+            # nothing uses the series of this job
+            continue
+
+        job = {
+            **base_job,
+            "job_name": job_name,
+            "metrics_path": metrics_path,
+            "static_configs": [{"targets": ["localhost:10250"], "labels": {"node": hostname}}],
+            "relabel_configs": [
+                {"target_label": "metrics_path", "replacement": metrics_path},
+                {"target_label": "job", "replacement": "kubelet"},
+            ],
+        }
+        if metrics_path == "/metrics":
+            rules += _route_jobs(KUBELET_JOB_PREFIXES)
+        if rules:
+            job["metric_relabel_configs"] = rules
+
+        scrape_jobs.append(job)
+
+    # charm instrumentation (see exporter.py)
+    scrape_jobs.append(
+        {
+            "job_name": "microk8s-charm",
+            "static_configs": [
+                {"targets": [f"localhost:{EXPORTER_PORT}"], "labels": {"node": hostname}}
+            ],
+            "relabel_configs": [{"target_label": "job", "replacement": "microk8s-charm"}],
+        }
+    )
+
+    for job in scrape_jobs:
+        job.update((scrape_intervals or {}).get(job["job_name"], {}))
 
     return scrape_jobs
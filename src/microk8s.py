@@ -1,17 +1,20 @@
 #
 # Copyright 2023 Canonical, Ltd.
 #
+import http.client
 import ipaddress
 import json
 import logging
+import math
 import os
 import shlex
-import subprocess
+import time
 from pathlib import Path
 
 from ops.model import ActiveStatus, MaintenanceStatus, WaitingStatus
 
 import charm_config
+import kubeapi
 import ops_helpers
 import util
 
@@ -42,11 +45,55 @@ def upgrade():
     util.ensure_call(cmd)
 
 
-def wait_ready(timeout: int = 30):
-    """`microk8s status --wait-ready`"""
+def _kubelet_healthy() -> bool:
+    """check the kubelet healthz endpoint on the local node"""
+    conn = http.client.HTTPConnection("127.0.0.1", 10248, timeout=2)
+    try:
+        conn.request("GET", "/healthz")
+        return conn.getresponse().status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        conn.close()
+
+
+def _probe_ready(deadline: float) -> bool:
+    """poll apiserver /readyz and kubelet /healthz with exponential backoff until both are
+    healthy. returns False if the deadline expires"""
+    client = kubeapi.get_client(snap_data_dir() / "credentials" / "kubelet.config")
+    delay = 0.1
+    while True:
+        try:
+            if client.probe("/readyz") and _kubelet_healthy():
+                return True
+        except (ConnectionError, TimeoutError) as e:
+            LOG.debug("apiserver is not ready yet: %s", e)
+
+        if time.monotonic() + delay > deadline:
+            return False
+
+        time.sleep(delay)
+        delay = min(delay * 2, 2)
+
+
+def wait_ready(timeout: int = 300):
+    """wait until the apiserver (/readyz) and the kubelet (/healthz) of the local node are ready.
+    falls back to `microk8s status --wait-ready` if the apiserver cannot be probed. raises
+    TimeoutError if the node is not ready in time"""
     LOG.info("Wait for MicroK8s to become ready")
+    deadline = time.monotonic() + timeout
+
+    try:
+        if _probe_ready(deadline):
+            return
+    except (OSError, ValueError, kubeapi.KubernetesError) as e:
+        LOG.warning("cannot probe apiserver readiness (%s), use microk8s status", e)
+    else:
+        raise TimeoutError(f"node did not become ready in {timeout} seconds")
+
+    remaining = max(math.ceil(deadline - time.monotonic()), 1)
     util.ensure_call(
-        ["microk8s", "status", "--wait-ready", f"--timeout={timeout}"], capture_output=True
+        ["microk8s", "status", "--wait-ready", f"--timeout={remaining}"], capture_output=True
     )
 
 
@@ -83,27 +130,19 @@ def add_node() -> str:
 def get_unit_status(hostname: str):
     """Retrieve node Ready condition from Kubernetes and convert to Juju unit status."""
     try:
-        # use the kubectl binary with the kubelet config directly
-        output = util.run(
-            [
-                f"{snap_dir()}/kubectl",
-                f"--kubeconfig={snap_data_dir()}/credentials/kubelet.config",
-                "get",
-                "node",
-                hostname,
-                "-o",
-                "jsonpath={.status.conditions[?(@.type=='Ready')]}",
-            ],
-            capture_output=True,
-        ).stdout
-        node_ready_condition = json.loads(output)
+        # use the kubelet config directly
+        client = kubeapi.get_client(snap_data_dir() / "credentials" / "kubelet.config")
+        node = client.get(f"/api/v1/nodes/{hostname}")
+        node_ready_condition = next(
+            c for c in node["status"]["conditions"] if c.get("type") == "Ready"
+        )
         if node_ready_condition["status"] == "False":
             LOG.warning("node %s is not ready: %s", hostname, node_ready_condition)
             return WaitingStatus(f"node is not ready: {node_ready_condition['reason']}")
 
         return ActiveStatus("node is ready")
 
-    except (subprocess.CalledProcessError, json.JSONDecodeError, KeyError) as e:
+    except (OSError, ValueError, kubeapi.KubernetesError, KeyError, StopIteration) as e:
         LOG.warning("could not retrieve status of node %s: %s", hostname, e)
         return MaintenanceStatus("waiting for node")
 
@@ -161,12 +200,13 @@ def apply_launch_configuration(config: dict):
     )
 
 
-def configure_extra_sans(extra_sans_str: str):
-    """add a list of extra SANs that are accepted by the kube-apiserver"""
+def configure_extra_sans(extra_sans_str: str) -> bool:
+    """add a list of extra SANs that are accepted by the kube-apiserver. returns True if the
+    kube-apiserver certificate was refreshed, which restarts the kube-apiserver"""
 
     if not extra_sans_str:
         LOG.debug("No extra SANs will be configured")
-        return
+        return False
 
     if "%UNIT_PUBLIC_ADDRESS%" in extra_sans_str:
         extra_sans_str = extra_sans_str.replace(
@@ -194,6 +234,9 @@ def configure_extra_sans(extra_sans_str: str):
     if util.ensure_file(path, new_csr_conf, 0o600, 0, 0):
         LOG.info("Update kube-apiserver certificate with extra SANs %s", extra_sans)
         util.ensure_call(["microk8s", "refresh-certs", "-e", "server.crt"])
+        return True
+
+    return False
 
 
 def configure_hostpath_storage(enable: bool):
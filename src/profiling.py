@@ -0,0 +1,133 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+import io
+import logging
+import os
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, Set
+
+import util
+
+# only needed when profiling is enabled or profiles are retrieved
+cProfile = util.lazy_import("cProfile")
+pstats = util.lazy_import("pstats")
+tarfile = util.lazy_import("tarfile")
+
+LOG = logging.getLogger(__name__)
+
+# environment variable to enable profiling, e.g. MICROK8S_CHARM_PROFILE="cpu,memory"
+PROFILE_ENV = "MICROK8S_CHARM_PROFILE"
+
+# file in the profiles directory with the enabled profile modes, written by the charm
+MODES_FILE = "enabled"
+
+# supported profile modes. "cpu" runs the hook under cProfile, "memory" under tracemalloc
+PROFILE_MODES = {"cpu", "memory"}
+
+# number of hooks to keep profiles for
+MAX_PROFILES = 20
+
+
+def parse_modes(modes: str) -> Set[str]:
+    """parse a comma-separated list of profile modes, e.g. "cpu,memory".
+    raises ValueError for unknown modes"""
+    result = {mode.strip() for mode in modes.split(",") if mode.strip()}
+    if result - PROFILE_MODES:
+        raise ValueError(f"unknown profile modes {sorted(result - PROFILE_MODES)}")
+    return result
+
+
+def set_modes(directory: Path, modes: Set[str]):
+    """enable profiling of the following hooks. an empty set disables profiling"""
+    modes_file = directory / MODES_FILE
+    if not modes:
+        modes_file.unlink(missing_ok=True)
+        return
+
+    directory.mkdir(parents=True, exist_ok=True)
+    modes_file.write_text(",".join(sorted(modes)))
+
+
+def get_modes(directory: Path) -> Set[str]:
+    """return the profile modes enabled for the current hook. the environment takes precedence
+    over the modes set by the charm"""
+    try:
+        modes = os.environ.get(PROFILE_ENV) or (directory / MODES_FILE).read_text()
+        return parse_modes(modes)
+    except (OSError, ValueError):
+        return set()
+
+
+def _rotate(directory: Path):
+    """remove profiles of old hooks, keeping the latest MAX_PROFILES"""
+    for name in _hooks(directory)[:-MAX_PROFILES]:
+        for file in directory.glob(f"{name}.*"):
+            file.unlink(missing_ok=True)
+
+
+def _hooks(directory: Path) -> List[str]:
+    """return the names of all profiled hooks, oldest first"""
+    return sorted({file.stem for file in directory.glob("*-*.*")})
+
+
+def run(func: Callable, directory: Path, hook: str):
+    """run func, profiling it if enabled. profiles are written to the directory as
+    "<timestamp>-<hook>.pstats" (cpu) and "<timestamp>-<hook>.tracemalloc" (memory)"""
+    modes = get_modes(directory)
+    if not modes:
+        return func()
+
+    name = f"{time.time_ns()}-{hook}"
+    profile = cProfile.Profile() if "cpu" in modes else None
+    if "memory" in modes:
+        tracemalloc.start()
+    if profile:
+        profile.enable()
+
+    try:
+        return func()
+    finally:
+        if profile:
+            profile.disable()
+
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            if profile:
+                profile.dump_stats(directory / f"{name}.pstats")
+            if "memory" in modes:
+                tracemalloc.take_snapshot().dump((directory / f"{name}.tracemalloc").as_posix())
+            _rotate(directory)
+        except OSError:
+            LOG.warning("failed to write profiles", exc_info=1)
+        finally:
+            tracemalloc.stop()
+
+
+def latest(directory: Path, count: int) -> List[Path]:
+    """return the profile files of the latest count hooks, newest first"""
+    files = []
+    for name in reversed(_hooks(directory)[-count:]):
+        files.extend(sorted(directory.glob(f"{name}.*")))
+    return files
+
+
+def summarize(file: Path, top: int) -> str:
+    """return a table of the top entries of a profile. cpu profiles are sorted by cumulative
+    time, memory profiles by allocated size"""
+    if file.suffix == ".tracemalloc":
+        snapshot = tracemalloc.Snapshot.load(file.as_posix())
+        return "\n".join(str(stat) for stat in snapshot.statistics("lineno")[:top])
+
+    out = io.StringIO()
+    pstats.Stats(file.as_posix(), stream=out).sort_stats("cumulative").print_stats(top)
+    return out.getvalue()
+
+
+def archive(files: List[Path], path: Path):
+    """write the files to a .tar.gz archive"""
+    with tarfile.open(path, "w:gz") as tar:
+        for file in files:
+            tar.add(file, arcname=file.name)
@@ -1,22 +1,48 @@
 #
 # Copyright 2023 Canonical, Ltd.
 #
+import importlib.util
 import logging
 import os
+import random
 import shlex
 import subprocess
+import sys
 import time
+import types
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional, Tuple
+
+import instrumentation
 
 LOG = logging.getLogger(__name__)
 
+# start of the current hook. every hook runs in a new process
+HOOK_START = time.monotonic()
+
 
 def run(*args, **kwargs) -> subprocess.CompletedProcess:
     """log and run command"""
     kwargs.setdefault("check", True)
 
     LOG.debug("Execute: %s (args=%s, kwargs=%s)", shlex.join(args[0]), args, kwargs)
-    return subprocess.run(*args, **kwargs)
+    start = time.monotonic()
+    exit_code, output_bytes = None, 0
+    try:
+        p = subprocess.run(*args, **kwargs)
+        exit_code, output_bytes = p.returncode, len(p.stdout or b"") + len(p.stderr or b"")
+        return p
+    except subprocess.CalledProcessError as e:
+        exit_code, output_bytes = e.returncode, len(e.stdout or b"") + len(e.stderr or b"")
+        raise
+    finally:
+        instrumentation.record_command(
+            instrumentation.command_name(args[0]),
+            time.monotonic() - start,
+            exit_code,
+            output_bytes,
+        )
 
 
 def install_required_packages():
@@ -83,26 +109,108 @@ def ensure_block(data: str, block: str, block_marker: str) -> str:
     return f"{data[:begin_index]}{marker_begin}{block}{data[end_index:]}"
 
 
-def _ensure_func(
-    f: callable, args: list, kwargs: dict, retry_on, max_retries: int = 10, backoff: int = 2
-):
-    """run a function until it does not raise one of the exceptions from retry_on"""
-    for idx in range(max_retries - 1):
-        try:
-            return f(*args, **kwargs)
-        except retry_on:
-            LOG.warning("action not successful (try %d of %d)", idx + 1, max_retries, exc_info=1)
-            time.sleep(backoff)
+@dataclass(frozen=True)
+class RetryPolicy:
+    """policy for retrying failed calls with exponential backoff and jitter"""
+
+    # delay before the first retry, multiplied by `multiplier` after every retry, up to max_delay
+    initial_delay: float = 0.5
+    multiplier: float = 2
+    max_delay: float = 4
+
+    # randomize each delay by up to +/- this fraction
+    jitter: float = 0.2
+
+    # give up after this many attempts
+    max_attempts: int = 8
+
+    # do not retry past this many seconds since the start of the hook. shared by all calls
+    deadline: Optional[float] = 600
+
+    # failed commands with these exit codes or stderr messages are not retried
+    permanent_exit_codes: Tuple[int, ...] = (126, 127)
+    permanent_stderr: Tuple[str, ...] = ()
+
+    # errors with an HTTP status (e.g. kubeapi.KubernetesError) are not retried for client errors
+    # (4xx), except for these status codes
+    retry_status_codes: Tuple[int, ...] = (429,)
+
+    def delay(self, attempt: int) -> float:
+        """return the delay before retrying after attempt `attempt` (starting from 1)"""
+        delay = min(self.initial_delay * self.multiplier ** (attempt - 1), self.max_delay)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
 
-    # last time run unprotected and raise any exception
-    return f(*args, **kwargs)
+    def is_permanent(self, e: Exception) -> bool:
+        """return True if an error must not be retried"""
+        status = getattr(e, "status", None)
+        if isinstance(status, int):
+            return 400 <= status < 500 and status not in self.retry_status_codes
 
+        if not isinstance(e, subprocess.CalledProcessError):
+            return False
+        if e.returncode in self.permanent_exit_codes:
+            return True
 
-def ensure_call(*args, **kwargs) -> subprocess.CompletedProcess:
+        stderr = e.stderr.decode(errors="replace") if isinstance(e.stderr, bytes) else e.stderr
+        return any(msg in (stderr or "") for msg in self.permanent_stderr)
+
+    def expired(self, delay: float) -> bool:
+        """return True if retrying after `delay` seconds would exceed the hook deadline"""
+        if self.deadline is None:
+            return False
+        return time.monotonic() + delay - HOOK_START > self.deadline
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+
+def ensure_func(f: callable, args: list, kwargs: dict, retry_on, policy: RetryPolicy = None):
+    """run a function until it does not raise one of the exceptions from retry_on"""
+    policy = policy or DEFAULT_RETRY_POLICY
+    name = instrumentation.command_name(args[0]) if f is run else getattr(f, "__qualname__", "")
+
+    start = time.monotonic()
+    for attempt in range(1, policy.max_attempts + 1):
+        try:
+            result = f(*args, **kwargs)
+        except retry_on as e:
+            delay = policy.delay(attempt)
+            if attempt == policy.max_attempts or policy.is_permanent(e) or policy.expired(delay):
+                instrumentation.record_retries(name, attempt - 1, time.monotonic() - start, False)
+                raise
+
+            LOG.warning(
+                "action not successful (try %d of %d)", attempt, policy.max_attempts, exc_info=1
+            )
+            time.sleep(delay)
+        else:
+            instrumentation.record_retries(name, attempt - 1, time.monotonic() - start, True)
+            return result
+
+
+def ensure_call(*args, retry_policy: RetryPolicy = None, **kwargs) -> subprocess.CompletedProcess:
     """repeatedly run a command until it succeeds. any args are passed to subprocess.run"""
-    return _ensure_func(run, args, kwargs, subprocess.CalledProcessError)
+    return ensure_func(run, args, kwargs, subprocess.CalledProcessError, retry_policy)
 
 
 def charm_dir() -> Path:
     """return top-level directory of the charm source code"""
     return Path(__file__).absolute().parent.parent
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """return a module that is only loaded when one of its attributes is first accessed. every
+    hook runs in a new process, so this avoids paying for the imports that a hook does not use"""
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -7,6 +7,7 @@ from unittest import mock
 import ops.testing
 import pytest
 
+import metrics
 from charm import MicroK8sCharm
 
 
@@ -37,7 +38,7 @@ def e():
         "sleep": mock.patch("time.sleep", autospec=True),
         # project mocks
         "containerd": mock.patch("charm.containerd", autospec=True),
-        "COSAgentProvider": mock.patch("charm.COSAgentProvider", autospec=True),
+        "COSAgentProvider": mock.patch("charm.cos_provider.COSAgentProvider", autospec=True),
         "metrics": mock.patch("charm.metrics", autospec=True),
         "microk8s": mock.patch("charm.microk8s", autospec=True),
         "util": mock.patch("charm.util", autospec=True),
@@ -47,6 +48,14 @@ def e():
     for k, v in patchers.items():
         mocks[k] = v.start()
 
+    # constants used to validate the charm configuration
+    mocks["metrics"].METRICS_PROFILES = metrics.METRICS_PROFILES
+    mocks["metrics"].KUBE_STATE_METRICS_ENDPOINTS = metrics.KUBE_STATE_METRICS_ENDPOINTS
+    mocks["metrics"].KUBE_STATE_METRICS_MAX_SHARDS = metrics.KUBE_STATE_METRICS_MAX_SHARDS
+
+    # the kube-apiserver certificate is not refreshed unless a test says otherwise
+    mocks["microk8s"].configure_extra_sans.return_value = False
+
     yield Environment(harness, **mocks)
 
     harness.cleanup()
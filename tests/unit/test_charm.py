@@ -2,7 +2,11 @@
 # Copyright 2023 Canonical, Ltd.
 #
 
+import json
+import os
 import subprocess
+import sys
+from pathlib import Path
 from unittest import mock
 
 import ops
@@ -11,6 +15,9 @@ import pytest
 from conftest import Environment
 from ops.model import BlockedStatus, WaitingStatus
 
+import instrumentation
+import profiling
+
 
 @pytest.mark.parametrize("role", ["worker", "control-plane", ""])
 def test_install(role, e: Environment):
@@ -26,6 +33,7 @@ def test_install(role, e: Environment):
 
     e.util.install_required_packages.assert_called_once_with()
     e.microk8s.install.assert_called_once_with()
+    e.metrics.install_exporter.assert_called_once_with(False)
     e.microk8s.set_containerd_proxy_options.assert_called_once_with(
         "fakehttpproxy", "fakehttpsproxy", "fakenoproxy"
     )
@@ -66,6 +74,7 @@ def test_remove(e: Environment):
     # remove uninstalls
     e.harness.charm.on.remove.emit()
     e.microk8s.uninstall.assert_called_once_with()
+    e.metrics.remove_exporter.assert_called_once_with()
 
     # exceptions in uninstall are ignored
     e.microk8s.uninstall.reset_mock()
@@ -102,6 +111,50 @@ def test_update_status(e: Environment):
     assert e.harness.charm.unit.status == ops.model.ActiveStatus("fakestatus3")
 
 
+@mock.patch("instrumentation.REPORT", new_callable=instrumentation.Report)
+@mock.patch("charm.time")
+def test_update_status_deadline(
+    time: mock.MagicMock, report: instrumentation.Report, e: Environment
+):
+    time.monotonic.side_effect = [0, 5, 10, 10]
+    e.microk8s.get_unit_status.return_value = ops.model.ActiveStatus("fakestatus")
+    e.harness.update_config({"node_ready_timeout": 10})
+    e.harness.begin()
+    e.harness.charm._state.joined = True
+
+    # node does not become ready before the deadline
+    e.microk8s.get_unit_status.reset_mock()
+    e.microk8s.get_unit_status.return_value = ops.model.MaintenanceStatus("waiting for node")
+    e.harness.charm.on.update_status.emit()
+
+    assert e.microk8s.get_unit_status.mock_calls == [mock.call(e.gethostname.return_value)] * 2
+    assert e.harness.charm.unit.status == ops.model.WaitingStatus("waiting for node")
+    assert report.node_ready_wait_seconds == 10
+    time.sleep.assert_called_once_with(2)
+
+
+@mock.patch("instrumentation.REPORT", new_callable=instrumentation.Report)
+def test_record_status_transitions(report: instrumentation.Report, e: Environment):
+    e.harness.begin()
+
+    # the unit status is not read from the backend
+    with mock.patch.object(e.harness._backend, "status_get", autospec=True) as status_get:
+        e.harness.framework.on.pre_commit.emit()
+        e.harness.charm._set_status(ops.model.MaintenanceStatus("installing"))
+        e.harness.framework.on.pre_commit.emit()
+        e.harness.charm._set_status(ops.model.MaintenanceStatus("joining cluster"))
+        e.harness.framework.on.pre_commit.emit()
+        e.harness.charm._set_status(ops.model.ActiveStatus("node is ready"))
+        e.harness.framework.on.pre_commit.emit()
+
+    status_get.assert_not_called()
+
+    assert report.status_transitions == [
+        instrumentation.StatusTransition("unknown", "maintenance"),
+        instrumentation.StatusTransition("maintenance", "active"),
+    ]
+
+
 @pytest.mark.parametrize("role", ["", "control-plane"])
 @pytest.mark.parametrize("has_joined", [False, True])
 def test_config_disable_cert_reissue(e: Environment, role: str, has_joined: bool):
@@ -152,6 +205,7 @@ def test_charm_upgrade(e: Environment, role: str):
     e.harness.charm.on.upgrade_charm.emit()
 
     e.microk8s.upgrade.assert_called_once_with()
+    e.metrics.install_exporter.assert_called_with(True)
 
 
 @pytest.mark.parametrize("role", ["", "control-plane"])
@@ -255,3 +309,99 @@ def test_config_rbac(e: Environment, role: str, is_leader: bool, has_joined: boo
         e.microk8s.configure_rbac.assert_called_once_with(False)
     else:
         e.microk8s.configure_rbac.assert_not_called()
+
+
+@pytest.mark.parametrize("role", ["", "worker"])
+def test_config_profile_hooks(e: Environment, role: str):
+    e.harness.update_config({"role": role, "profile_hooks": "cpu"})
+    e.harness.begin_with_initial_hooks()
+
+    e.harness.update_config({"profile_hooks": "disk"})
+    assert e.harness.charm.unit.status == BlockedStatus(
+        "invalid profile_hooks, check logs for details"
+    )
+
+
+@pytest.mark.parametrize("role", ["", "worker"])
+def test_config_metrics_profile(e: Environment, role: str):
+    e.harness.update_config({"role": role})
+    e.harness.begin_with_initial_hooks()
+    assert not isinstance(e.harness.charm.unit.status, BlockedStatus)
+
+    e.harness.update_config({"metrics_profile": "invalid"})
+    assert e.harness.charm.unit.status == BlockedStatus(
+        "metrics_profile must be one of ['full', 'standard', 'minimal']"
+    )
+
+    # all series are ingested until the profile is fixed
+    relation = "peer" if role != "worker" else "control-plane"
+    if role == "worker":
+        e.harness.add_relation(relation, "microk8s-cp")
+    rel = e.harness.model.get_relation(relation)
+    e.harness.update_relation_data(
+        rel.id, rel.app.name, {"metrics_crt": "fakecrt", "metrics_key": "fakekey"}
+    )
+    e.harness.charm._state.joined = True
+    e.harness.charm._build_scrape_configs()
+    assert e.metrics.build_scrape_jobs.call_args.args[-2] == "full"
+
+
+@pytest.mark.parametrize("role", ["", "worker"])
+def test_config_scrape_intervals(e: Environment, role: str):
+    e.harness.update_config({"role": role})
+    e.harness.begin_with_initial_hooks()
+
+    e.metrics.parse_scrape_intervals.side_effect = ValueError("invalid")
+    e.harness.update_config({"scrape_intervals": '{"cadvisor": {"timeout": "2m"}}'})
+    assert e.harness.charm.unit.status == BlockedStatus(
+        "invalid scrape_intervals, check logs for details"
+    )
+    e.metrics.parse_scrape_intervals.assert_called_with('{"cadvisor": {"timeout": "2m"}}')
+
+    # default intervals are used until the configuration is fixed
+    relation = "peer" if role != "worker" else "control-plane"
+    if role == "worker":
+        e.harness.add_relation(relation, "microk8s-cp")
+    rel = e.harness.model.get_relation(relation)
+    e.harness.update_relation_data(
+        rel.id, rel.app.name, {"metrics_crt": "fakecrt", "metrics_key": "fakekey"}
+    )
+    e.harness.charm._state.joined = True
+    e.harness.charm._build_scrape_configs()
+    assert e.metrics.build_scrape_jobs.call_args.args[-1] == {}
+
+
+@mock.patch.dict(os.environ, {"MICROK8S_CHARM_PROFILE": "cpu"})
+def test_get_profiles_action(e: Environment, tmp_path: Path):
+    e.util.charm_dir.return_value = tmp_path
+    e.harness.begin()
+
+    event = mock.MagicMock(params={"count": 1, "top": 5, "archive": False})
+    e.harness.charm.on_get_profiles_action(event)
+    event.fail.assert_called_once()
+
+    profiling.run(lambda: None, tmp_path / "profiles", "update-status")
+    event = mock.MagicMock(params={"count": 1, "top": 5, "archive": True})
+    e.harness.charm.on_get_profiles_action(event)
+
+    results = event.set_results.call_args[0][0]
+    assert "-update-status.pstats" in results["summary"]
+    assert results["archive"] == (tmp_path / "profiles.tar.gz").as_posix()
+    assert (tmp_path / "profiles.tar.gz").exists()
+
+
+def test_lazy_imports():
+    # modules that only some hooks need must not be imported on startup
+    script = "import json, sys, charm; print(json.dumps(sorted(sys.modules)))"
+    p = subprocess.run(
+        [sys.executable, "-c", script],
+        env={**os.environ, "PYTHONPATH": "lib:src"},
+        cwd=Path(__file__).parent.parent.parent,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+    modules = set(json.loads(p.stdout))
+    for module in ["pydantic", "cosl", "tomli_w", "urllib3"]:
+        assert module not in modules
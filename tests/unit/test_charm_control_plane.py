@@ -1,6 +1,7 @@
 #
 # Copyright 2023 Canonical, Ltd.
 #
+import os
 import subprocess
 from unittest import mock
 
@@ -275,11 +276,42 @@ def test_build_scrape_configs(e: Environment, role: str, is_leader: bool, has_jo
         e.metrics.build_scrape_jobs.assert_not_called()
     else:
         e.metrics.build_scrape_jobs.assert_called_once_with(
-            "fakecrt", "fakekey", True, "fakehostname"
+            "fakecrt",
+            "fakekey",
+            True,
+            "fakehostname",
+            is_leader,
+            "proxy",
+            1,
+            "full",
+            e.metrics.parse_scrape_intervals.return_value,
         )
         assert result == e.metrics.build_scrape_jobs.return_value
 
 
+@pytest.mark.parametrize(
+    "hook, related, constructed",
+    [
+        ("update-status", False, False),
+        ("update-status", True, True),
+        ("cos-agent-relation-created", False, True),
+    ],
+)
+def test_cos_agent_provider_when_related(
+    e: Environment, hook: str, related: bool, constructed: bool
+):
+    e.microk8s.get_unit_status.return_value = ops.model.ActiveStatus("fakestatus")
+
+    e.harness.update_config({"role": "control-plane"})
+    if related:
+        e.harness.add_relation("cos-agent", "grafana-agent")
+
+    with mock.patch.dict(os.environ, {"JUJU_DISPATCH_PATH": f"hooks/{hook}"}):
+        e.harness.begin()
+
+    assert e.COSAgentProvider.called == constructed
+
+
 @pytest.mark.parametrize("is_leader", (True, False))
 def test_cos_agent_relation(e: Environment, is_leader: bool):
     e.microk8s.get_unit_status.return_value = ops.model.ActiveStatus("fakestatus")
@@ -290,18 +322,20 @@ def test_cos_agent_relation(e: Environment, is_leader: bool):
     e.harness.add_network("10.10.10.10")
     e.harness.update_config({"role": "control-plane"})
     e.harness.set_leader(True)
+    metrics_rel_id = e.harness.add_relation("cos-agent", "grafana-agent")
     e.harness.begin_with_initial_hooks()
 
     e.harness.set_leader(is_leader)
 
-    e.metrics.apply_required_resources.assert_not_called()
+    # the resources are applied on config-changed, as the relation already exists
+    e.metrics.apply_required_resources.assert_called_once_with("proxy", 1)
+    e.metrics.apply_required_resources.reset_mock()
     e.metrics.get_tls_auth.assert_not_called()
     e.metrics.build_scrape_jobs.assert_not_called()
 
     worker_rel_id = e.harness.add_relation("workers", "microk8s-worker")
     e.harness.add_relation_unit(worker_rel_id, "microk8s-worker/0")
 
-    metrics_rel_id = e.harness.add_relation("cos-agent", "grafana-agent")
     e.harness.add_relation_unit(metrics_rel_id, "grafana-agent/0")
     peer_rel_id = e.harness.model.get_relation("peer").id
     peer_data = e.harness.get_relation_data(peer_rel_id, e.harness.charm.app.name)
@@ -321,11 +355,15 @@ def test_cos_agent_relation(e: Environment, is_leader: bool):
     assert {evt.event_kind for evt in called_with_refresh_events} == {
         "peer_relation_changed",
         "upgrade_charm",
+        "config_changed",
+        "leader_elected",
+        "leader_settings_changed",
     }
 
     if is_leader:
-        e.metrics.apply_required_resources.assert_called_once_with()
-        e.metrics.get_tls_auth.assert_called_once_with()
+        e.metrics.apply_required_resources.assert_called_once_with("proxy", 1)
+        # once when the worker joins, and once when grafana-agent joins
+        assert e.metrics.get_tls_auth.call_count == 2
 
         for data in (peer_data, workers_data):
             assert data["metrics_crt"] == "fakecrt"
@@ -370,3 +408,152 @@ def test_cos_agent_relation(e: Environment, is_leader: bool):
             assert data["metrics_key"] == "fakekey2"
     else:
         e.metrics.get_tls_auth.assert_not_called()
+
+
+def test_config_changed_single_wait_ready(e: Environment):
+    e.microk8s.get_unit_status.return_value = ops.model.ActiveStatus("fakestatus")
+
+    e.harness.update_config({"role": "control-plane"})
+    e.harness.set_leader(True)
+    e.harness.begin_with_initial_hooks()
+
+    # a new dispatch, the node has not been verified to be ready yet
+    e.harness.charm._ready = False
+    e.microk8s.wait_ready.reset_mock()
+    e.microk8s.configure_rbac.reset_mock()
+
+    # rbac and certificate reissue both need the node to be ready, check only once
+    e.harness.update_config({"rbac": True, "automatic_certificate_reissue": False})
+
+    e.microk8s.wait_ready.assert_called_once_with()
+    e.microk8s.configure_rbac.assert_called_once_with(True)
+    e.microk8s.disable_cert_reissue.assert_called_once_with()
+    assert e.harness.charm.unit.status == ops.model.ActiveStatus("fakestatus")
+
+
+def test_config_changed_wait_ready_after_refresh_certs(e: Environment):
+    e.microk8s.get_unit_status.return_value = ops.model.ActiveStatus("fakestatus")
+
+    e.harness.update_config({"role": "control-plane"})
+    e.harness.set_leader(True)
+    e.harness.begin_with_initial_hooks()
+
+    # a new dispatch, the node has not been verified to be ready yet
+    e.harness.charm._ready = False
+    e.harness.charm._state.joined = True
+    e.microk8s.reset_mock()
+    e.microk8s.configure_extra_sans.return_value = True
+
+    # refreshing the kube-apiserver certificate restarts the kube-apiserver, wait for it again
+    e.harness.update_config(
+        {"rbac": True, "automatic_certificate_reissue": False, "extra_sans": "k8s.local"}
+    )
+
+    calls = [c for c in e.microk8s.mock_calls if c[0] in ("configure_extra_sans", "wait_ready")]
+    assert calls == [
+        mock.call.wait_ready(),
+        mock.call.configure_extra_sans("k8s.local"),
+        mock.call.wait_ready(),
+    ]
+    e.microk8s.configure_rbac.assert_called_once_with(True)
+
+
+def test_config_changed_skip_after_blocked(e: Environment):
+    e.microk8s.get_unit_status.return_value = ops.model.ActiveStatus("fakestatus")
+    e.containerd.parse_registries.side_effect = ValueError("fake error")
+
+    e.harness.update_config({"role": "control-plane"})
+    e.harness.set_leader(True)
+    e.harness.begin_with_initial_hooks()
+
+    e.microk8s.configure_extra_sans.assert_not_called()
+    e.microk8s.configure_rbac.assert_not_called()
+    assert isinstance(e.harness.charm.unit.status, ops.model.BlockedStatus)
+
+
+def test_config_changed_skip_unchanged(e: Environment):
+    e.microk8s.get_unit_status.return_value = ops.model.ActiveStatus("fakestatus")
+
+    e.harness.update_config({"role": "control-plane", "rbac": True})
+    e.harness.set_leader(True)
+    e.harness.begin_with_initial_hooks()
+
+    e.microk8s.configure_rbac.assert_called_once_with(True)
+    e.microk8s.configure_rbac.reset_mock()
+    e.microk8s.set_containerd_proxy_options.reset_mock()
+
+    # unrelated change, only the extra SANs are configured again
+    e.harness.update_config({"extra_sans": "k8s.local"})
+    e.microk8s.configure_extra_sans.assert_called_with("k8s.local")
+    e.microk8s.configure_rbac.assert_not_called()
+    e.microk8s.set_containerd_proxy_options.assert_not_called()
+
+    # configuration is applied again after a charm upgrade
+    e.harness.charm.on.upgrade_charm.emit()
+    e.harness.update_config({"extra_sans": "k8s.local"})
+    e.microk8s.configure_rbac.assert_called_once_with(True)
+    e.microk8s.set_containerd_proxy_options.assert_called_once_with("", "", "")
+
+
+def test_config_kube_state_metrics(e: Environment):
+    e.microk8s.get_unit_status.return_value = ops.model.ActiveStatus("fakestatus")
+    e.metrics.get_tls_auth.return_value = ("fakecrt", "fakekey")
+
+    e.harness.update_config({"role": "control-plane"})
+    e.harness.set_leader(True)
+    e.harness.begin_with_initial_hooks()
+
+    # not related to grafana-agent
+    e.harness.update_config({"kube_state_metrics_endpoint": "nodeport"})
+    e.metrics.apply_required_resources.assert_not_called()
+
+    rel_id = e.harness.add_relation("cos-agent", "grafana-agent")
+    e.harness.add_relation_unit(rel_id, "grafana-agent/0")
+    e.metrics.apply_required_resources.reset_mock()
+
+    e.harness.update_config({"kube_state_metrics_endpoint": "proxy"})
+    e.metrics.apply_required_resources.assert_called_once_with("proxy", 1)
+
+    e.metrics.apply_required_resources.reset_mock()
+    e.harness.update_config({"kube_state_metrics_shards": 3})
+    e.metrics.apply_required_resources.assert_called_once_with("proxy", 3)
+
+    e.metrics.apply_required_resources.reset_mock()
+    e.harness.update_config({"kube_state_metrics_shards": 0})
+    assert isinstance(e.harness.charm.unit.status, ops.model.BlockedStatus)
+    e.metrics.apply_required_resources.assert_not_called()
+    e.harness.update_config({"kube_state_metrics_shards": 1})
+
+    e.harness.update_config({"kube_state_metrics_endpoint": "invalid"})
+    assert isinstance(e.harness.charm.unit.status, ops.model.BlockedStatus)
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {"kube_state_metrics_endpoint": "invalid"},
+        {"kube_state_metrics_shards": 0},
+        {"kube_state_metrics_shards": 17},
+    ],
+)
+def test_build_scrape_configs_kube_state_metrics_invalid(e: Environment, config: dict):
+    e.microk8s.get_unit_status.return_value = ops.model.ActiveStatus("fakestatus")
+    e.metrics.get_tls_auth.return_value = ("fakecrt", "fakekey")
+
+    e.harness.update_config({"role": "control-plane"})
+    e.harness.set_leader(True)
+    e.harness.begin_with_initial_hooks()
+
+    rel_id = e.harness.add_relation("cos-agent", "grafana-agent")
+    e.harness.add_relation_unit(rel_id, "grafana-agent/0")
+    e.harness.update_config(config)
+    assert isinstance(e.harness.charm.unit.status, ops.model.BlockedStatus)
+
+    # the default kube-state-metrics endpoint is scraped until the configuration is fixed
+    rel = e.harness.model.get_relation("peer")
+    e.harness.update_relation_data(
+        rel.id, rel.app.name, {"metrics_crt": "fakecrt", "metrics_key": "fakekey"}
+    )
+    e.harness.charm._state.joined = True
+    e.harness.charm._build_scrape_configs()
+    assert e.metrics.build_scrape_jobs.call_args.args[5:7] == ("proxy", 1)
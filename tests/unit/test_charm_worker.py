@@ -145,6 +145,14 @@ def test_build_scrape_configs(e: Environment, role: str, is_leader: bool, has_jo
         e.metrics.build_scrape_jobs.assert_not_called()
     else:
         e.metrics.build_scrape_jobs.assert_called_once_with(
-            "fakecrt", "fakekey", False, "fakehostname"
+            "fakecrt",
+            "fakekey",
+            False,
+            "fakehostname",
+            is_leader,
+            "proxy",
+            1,
+            "full",
+            e.metrics.parse_scrape_intervals.return_value,
         )
         assert result == e.metrics.build_scrape_jobs.return_value
@@ -0,0 +1,219 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+import json
+import subprocess
+import sys
+from pathlib import Path
+from unittest import mock
+
+from charms.grafana_agent.v0.cos_agent import GrafanaDashboard
+from cosl import JujuTopology
+from cosl.rules import AlertRules
+from ops import CharmBase
+from ops.testing import Harness
+
+import cos_provider
+import instrumentation
+
+ROOT = Path(__file__).parent.parent.parent
+
+# size of the serialized dashboards sent over the cos-agent relation
+DASHBOARDS_PAYLOAD_BUDGET = 50 * 1024
+
+
+def test_serialize_dashboards(tmp_path: Path):
+    dashboards_dir = tmp_path / "dashboards"
+    dashboards_dir.mkdir()
+    (dashboards_dir / "a.json").write_text(json.dumps({"title": "a"}))
+    (dashboards_dir / "b.json").write_text(json.dumps({"title": "b"}))
+    cache_file = tmp_path / "cache" / "dashboards.json"
+
+    with mock.patch.object(
+        GrafanaDashboard, "_serialize", wraps=GrafanaDashboard._serialize
+    ) as serialize:
+        # nothing cached
+        dashboards = cos_provider.serialize_dashboards([dashboards_dir.as_posix()], cache_file)
+        assert [d._deserialize() for d in dashboards] == [{"title": "a"}, {"title": "b"}]
+        assert serialize.call_count == 2
+        assert cache_file.exists()
+
+        # all cached
+        serialize.reset_mock()
+        assert (
+            cos_provider.serialize_dashboards([dashboards_dir.as_posix()], cache_file) == dashboards
+        )
+        serialize.assert_not_called()
+
+        # only changed dashboards are serialized again
+        (dashboards_dir / "b.json").write_text(json.dumps({"title": "c"}))
+        dashboards = cos_provider.serialize_dashboards([dashboards_dir.as_posix()], cache_file)
+        assert [d._deserialize() for d in dashboards] == [{"title": "a"}, {"title": "c"}]
+        serialize.assert_called_once_with(b'{"title":"c"}')
+
+        # removed dashboards are dropped from the cache
+        (dashboards_dir / "b.json").unlink()
+        cos_provider.serialize_dashboards([dashboards_dir.as_posix()], cache_file)
+        assert list(json.loads(cache_file.read_text())) == [(dashboards_dir / "a.json").as_posix()]
+
+
+def test_serialize_dashboards_invalid_cache(tmp_path: Path):
+    (tmp_path / "a.json").write_text(json.dumps({"title": "a"}))
+    cache_file = tmp_path / "dashboards.json"
+    cache_file.write_text("invalid")
+
+    dashboards = cos_provider.serialize_dashboards([tmp_path.as_posix()], cache_file)
+    assert dashboards[0]._deserialize() == {"title": "a"}
+
+
+def test_serialize_dashboards_readonly_cache(tmp_path: Path):
+    (tmp_path / "a.json").write_text(json.dumps({"title": "a"}))
+
+    # failing to write the cache is not fatal
+    dashboards = cos_provider.serialize_dashboards(
+        [tmp_path.as_posix()], tmp_path / "a.json" / "dashboards.json"
+    )
+    assert dashboards[0]._deserialize() == {"title": "a"}
+
+
+def test_serialize_dashboards_manifest(tmp_path: Path):
+    dashboards_dir = tmp_path / "dashboards"
+    dashboards_dir.mkdir()
+    (dashboards_dir / "a.json").write_text(json.dumps({"title": "a"}, indent=4))
+    (dashboards_dir / "b.json").write_text(json.dumps({"title": "b"}, indent=4))
+    cache_file = tmp_path / "cache" / "dashboards.json"
+    manifest_file = tmp_path / "manifest.json"
+
+    subprocess.run(
+        [
+            sys.executable,
+            "src/hack/build_dashboards.py",
+            "--dashboards-dir",
+            dashboards_dir.as_posix(),
+            "--output",
+            manifest_file.as_posix(),
+        ],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+    )
+
+    # same as serializing the dashboards in the hook
+    expected = cos_provider.serialize_dashboards([dashboards_dir.as_posix()], tmp_path / "none")
+
+    with mock.patch.object(
+        GrafanaDashboard, "_serialize", wraps=GrafanaDashboard._serialize
+    ) as serialize:
+        dashboards = cos_provider.serialize_dashboards(
+            [dashboards_dir.as_posix()], cache_file, manifest_file
+        )
+        assert dashboards == expected
+        assert [d._deserialize() for d in dashboards] == [{"title": "a"}, {"title": "b"}]
+        serialize.assert_not_called()
+        assert not cache_file.exists()
+
+        # dashboards that do not match the manifest are serialized and cached
+        (dashboards_dir / "b.json").write_text(json.dumps({"title": "c"}))
+        dashboards = cos_provider.serialize_dashboards(
+            [dashboards_dir.as_posix()], cache_file, manifest_file
+        )
+        assert dashboards[0] == expected[0]
+        serialize.assert_called_once_with(b'{"title":"c"}')
+        assert list(json.loads(cache_file.read_text())) == [(dashboards_dir / "b.json").as_posix()]
+
+
+def test_dashboards_minified():
+    subprocess.run(
+        [sys.executable, "src/hack/update_dashboards.py", "--check"],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+    )
+
+
+def test_dashboards_payload_budget(tmp_path: Path):
+    dashboards = cos_provider.serialize_dashboards(
+        [(ROOT / "src" / "grafana_dashboards").as_posix()], tmp_path / "dashboards.json"
+    )
+    assert sum(len(d) for d in dashboards) <= DASHBOARDS_PAYLOAD_BUDGET
+
+
+def test_load_alert_rules(tmp_path: Path):
+    rules_dir = tmp_path / "rules"
+    rules_dir.mkdir()
+    (rules_dir / "a.yaml").write_text("groups: [{name: a, rules: [{alert: A, expr: 'up == 0'}]}]\n")
+    cache_file = tmp_path / "cache" / "alert_rules.json"
+    topology = {
+        "model": "m",
+        "model_uuid": "00000000-0000-4000-8000-000000000000",
+        "application": "k8s",
+    }
+
+    expected = AlertRules(query_type="promql", topology=JujuTopology.from_dict(topology))
+    expected.add_path(rules_dir.as_posix())
+
+    with mock.patch.object(cos_provider, "AlertRules", wraps=AlertRules) as m:
+        rules = cos_provider.load_alert_rules(rules_dir.as_posix(), False, topology, cache_file)
+        assert rules == expected.as_dict()
+        assert m.call_count == 1
+
+        # cached
+        assert (
+            cos_provider.load_alert_rules(rules_dir.as_posix(), False, topology, cache_file)
+            == rules
+        )
+        assert m.call_count == 1
+
+        # topology changed
+        topology["application"] = "microk8s"
+        rules = cos_provider.load_alert_rules(rules_dir.as_posix(), False, topology, cache_file)
+        assert rules["groups"][0]["rules"][0]["labels"]["juju_application"] == "microk8s"
+        assert m.call_count == 2
+
+        # rules changed
+        (rules_dir / "b.yaml").write_text(
+            "groups: [{name: b, rules: [{alert: B, expr: 'up == 1'}]}]\n"
+        )
+        rules = cos_provider.load_alert_rules(rules_dir.as_posix(), False, topology, cache_file)
+        assert sorted(g["rules"][0]["alert"] for g in rules["groups"]) == ["A", "B"]
+        assert m.call_count == 3
+
+
+class _Charm(CharmBase):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.jobs = ["a"]
+        self.cos = cos_provider.COSAgentProvider(
+            self,
+            scrape_configs=lambda: [{"job_name": job, "static_configs": []} for job in self.jobs],
+            refresh_events=[self.on.update_status],
+        )
+
+
+@mock.patch("instrumentation.REPORT", new_callable=instrumentation.Report)
+def test_cos_agent_provider_skips_unchanged_writes(report: instrumentation.Report, tmp_path: Path):
+    harness = Harness(
+        _Charm, meta="{name: test, provides: {cos-agent: {interface: cos_agent, scope: container}}}"
+    )
+    harness.begin()
+    rel_id = harness.add_relation("cos-agent", "grafana-agent")
+    with mock.patch("util.charm_dir", return_value=tmp_path):
+        harness.add_relation_unit(rel_id, "grafana-agent/0")
+        assert [w.skipped for w in report.relation_writes] == [False]
+
+        # nothing changed, relation data is not written
+        harness.update_relation_data(rel_id, "test/0", {"config": "unchanged"})
+        harness.charm.cos._stored._data.dirty = False
+        harness.charm.on.update_status.emit()
+        assert [w.skipped for w in report.relation_writes] == [False, True]
+        assert harness.get_relation_data(rel_id, "test/0")["config"] == "unchanged"
+
+        # stored state is not changed, so it is not committed
+        assert not harness.charm.cos._stored._data.dirty
+
+        harness.charm.jobs = ["a", "b"]
+        harness.charm.on.update_status.emit()
+        assert [w.skipped for w in report.relation_writes] == [False, True, False]
+
+    data = json.loads(harness.get_relation_data(rel_id, "test/0")["config"])
+    assert [job["job_name"] for job in data["metrics_scrape_jobs"]] == ["test_0_a", "test_1_b"]
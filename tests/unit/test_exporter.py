@@ -0,0 +1,38 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+import threading
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+import exporter
+
+
+@pytest.fixture
+def server(tmp_path: Path):
+    srv = exporter.make_server(tmp_path, "127.0.0.1", 0)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+
+    yield srv
+
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_exporter(server, tmp_path: Path):
+    (tmp_path / "handlers.prom").write_text("metric_a 1\n")
+    (tmp_path / "subprocess.prom").write_text("metric_b 2\n")
+    (tmp_path / "counters.json").write_text("{}")
+
+    with urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+        assert response.headers["Content-Type"] == "text/plain; version=0.0.4"
+        assert response.read() == b"metric_a 1\nmetric_b 2\n"
+
+    with pytest.raises(HTTPError) as e:
+        urlopen(f"http://127.0.0.1:{server.server_port}/other")
+
+    assert e.value.code == 404
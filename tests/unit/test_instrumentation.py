@@ -0,0 +1,119 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+import json
+from pathlib import Path
+from unittest import mock
+
+import instrumentation
+
+
+@mock.patch("instrumentation.REPORT", new_callable=instrumentation.Report)
+def test_record_retries(report: instrumentation.Report):
+    instrumentation.record_retries("snap install", 0, 1.5, True)
+    instrumentation.record_retries("microk8s join", 3, 10.0, False)
+
+    assert report.retries == [
+        instrumentation.RetryRecord("snap install", 0, 1.5, True),
+        instrumentation.RetryRecord("microk8s join", 3, 10.0, False),
+    ]
+
+
+@mock.patch("instrumentation.REPORT", new_callable=instrumentation.Report)
+def test_write_report(report: instrumentation.Report, tmp_path: Path):
+    instrumentation.record_command("microk8s status", 1.5, 0, 100)
+    instrumentation.record_command("snap install", 1, 1, 10)
+    instrumentation.record_command("snap install", 2, 0, 20)
+    instrumentation.record_retries("snap install", 1, 3, True)
+
+    instrumentation.write_report(tmp_path, "config-changed")
+
+    # journal
+    lines = (tmp_path / "journal.jsonl").read_text().splitlines()
+    assert len(lines) == 1
+    entry = json.loads(lines[0])
+    assert entry["hook"] == "config-changed"
+    assert entry["commands"][0] == {
+        "cmd": "microk8s status",
+        "seconds": 1.5,
+        "exit_code": 0,
+        "output_bytes": 100,
+    }
+    assert entry["retries"] == [
+        {"name": "snap install", "retries": 1, "seconds": 3, "succeeded": True}
+    ]
+
+    # metrics
+    prom = (tmp_path / "subprocess.prom").read_text()
+    assert 'microk8s_charm_subprocess_calls_total{cmd="snap install"} 2' in prom
+    assert 'microk8s_charm_subprocess_failures_total{cmd="snap install"} 1' in prom
+    assert 'microk8s_charm_subprocess_seconds_total{cmd="microk8s status"} 1.5' in prom
+    assert 'microk8s_charm_subprocess_output_bytes_total{cmd="snap install"} 30' in prom
+    assert 'microk8s_charm_subprocess_retries_total{cmd="snap install"} 1' in prom
+    assert 'microk8s_charm_subprocess_retries_total{cmd="microk8s status"} 0' in prom
+
+    # counters are cumulative across hooks
+    instrumentation.write_report(tmp_path, "update-status")
+    prom = (tmp_path / "subprocess.prom").read_text()
+    assert 'microk8s_charm_subprocess_calls_total{cmd="snap install"} 4' in prom
+    assert len((tmp_path / "journal.jsonl").read_text().splitlines()) == 2
+
+
+@mock.patch("instrumentation.REPORT", new_callable=instrumentation.Report)
+@mock.patch("instrumentation.JOURNAL_MAX_BYTES", 10)
+def test_write_report_rotate_journal(report: instrumentation.Report, tmp_path: Path):
+    (tmp_path / "journal.jsonl").write_text("x" * 20)
+
+    instrumentation.write_report(tmp_path, "install")
+
+    assert (tmp_path / "journal.jsonl.1").read_text() == "x" * 20
+    assert len((tmp_path / "journal.jsonl").read_text().splitlines()) == 1
+
+
+def test_command_name():
+    assert instrumentation.command_name(["microk8s", "status"]) == "microk8s status"
+    assert instrumentation.command_name(["/snap/microk8s/current/kubectl"]) == "kubectl"
+
+
+@mock.patch("instrumentation.REPORT", new_callable=instrumentation.Report)
+def test_timed(report: instrumentation.Report):
+    class Charm:
+        @instrumentation.timed
+        def update_status(self, event):
+            return "retval"
+
+    event = mock.MagicMock()
+    event.handle.kind = "update_status"
+
+    assert Charm().update_status(event) == "retval"
+    assert Charm.update_status.__name__ == "update_status"
+    assert len(report.handlers) == 1
+    assert report.handlers[0].event == "update_status"
+    assert report.handlers[0].handler == "update_status"
+
+
+@mock.patch("instrumentation.REPORT", new_callable=instrumentation.Report)
+def test_write_report_handlers(report: instrumentation.Report, tmp_path: Path):
+    instrumentation.record_handler("config_changed", "config_rbac", 0.3)
+    instrumentation.record_handler("config_changed", "config_rbac", 7)
+    instrumentation.record_status_transition("maintenance", "active")
+    instrumentation.record_relation_write("cos-agent", skipped=False)
+    instrumentation.record_relation_write("cos-agent", skipped=True)
+    instrumentation.record_relation_write("cos-agent", skipped=True)
+    instrumentation.record_node_ready_wait(4.5)
+
+    instrumentation.write_report(tmp_path, "config-changed")
+    instrumentation.write_report(tmp_path, "config-changed")
+
+    prom = (tmp_path / "handlers.prom").read_text()
+    labels = 'event="config_changed",handler="config_rbac"'
+    assert f'microk8s_charm_handler_duration_seconds_bucket{{{labels},le="0.1"}} 0' in prom
+    assert f'microk8s_charm_handler_duration_seconds_bucket{{{labels},le="0.5"}} 2' in prom
+    assert f'microk8s_charm_handler_duration_seconds_bucket{{{labels},le="10"}} 4' in prom
+    assert f'microk8s_charm_handler_duration_seconds_bucket{{{labels},le="+Inf"}} 4' in prom
+    assert f"microk8s_charm_handler_duration_seconds_sum{{{labels}}} 14.6" in prom
+    assert f"microk8s_charm_handler_duration_seconds_count{{{labels}}} 4" in prom
+    assert 'microk8s_charm_status_transitions_total{from="maintenance",to="active"} 2' in prom
+    assert 'microk8s_charm_relation_writes_total{relation="cos-agent",result="skipped"} 4' in prom
+    assert 'microk8s_charm_relation_writes_total{relation="cos-agent",result="written"} 2' in prom
+    assert "microk8s_charm_node_ready_wait_seconds 4.5" in prom
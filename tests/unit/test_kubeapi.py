@@ -0,0 +1,259 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+import base64
+import json
+import ssl
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import yaml
+
+import kubeapi
+
+
+class FakeAPIServer(ThreadingHTTPServer):
+    """HTTPS server that records requests and responds with canned responses"""
+
+    def __init__(self, cert: Path, key: Path):
+        super().__init__(("127.0.0.1", 0), FakeAPIHandler)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+        self.connections = 0
+        self.requests = []
+        self.responses = {}
+
+    def get_request(self):
+        self.connections += 1
+        return super().get_request()
+
+
+class FakeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.requests.append((self.command, self.path, dict(self.headers), body))
+
+        status, response = self.server.responses.get(self.path, (404, {"message": "not found"}))
+        data = json.dumps(response).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path: Path):
+    cert, key = tmp_path / "server.crt", tmp_path / "server.key"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            key.as_posix(),
+            "-out",
+            cert.as_posix(),
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+    srv = FakeAPIServer(cert, key)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+
+    yield srv
+
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture
+def kubeconfig(server: FakeAPIServer, tmp_path: Path) -> Path:
+    path = tmp_path / "kubelet.config"
+    ca = base64.b64encode((tmp_path / "server.crt").read_bytes()).decode()
+    path.write_text(
+        yaml.safe_dump(
+            {
+                "apiVersion": "v1",
+                "kind": "Config",
+                "current-context": "microk8s",
+                "contexts": [{"name": "microk8s", "context": {"cluster": "c", "user": "u"}}],
+                "clusters": [
+                    {
+                        "name": "c",
+                        "cluster": {
+                            "server": f"https://127.0.0.1:{server.server_port}",
+                            "certificate-authority-data": ca,
+                        },
+                    }
+                ],
+                "users": [{"name": "u", "user": {"token": "faketoken"}}],
+            }
+        )
+    )
+    return path
+
+
+def test_client_get(server: FakeAPIServer, kubeconfig: Path):
+    server.responses["/api/v1/nodes/node-1"] = (200, {"kind": "Node"})
+
+    client = kubeapi.Client(kubeconfig)
+    assert client.get("/api/v1/nodes/node-1") == {"kind": "Node"}
+
+    method, path, headers, _ = server.requests[0]
+    assert (method, path) == ("GET", "/api/v1/nodes/node-1")
+    assert headers["Authorization"] == "Bearer faketoken"
+
+
+def test_client_reuse_connection(server: FakeAPIServer, kubeconfig: Path):
+    server.responses["/api/v1/nodes/node-1"] = (200, {"kind": "Node"})
+
+    client = kubeapi.Client(kubeconfig)
+    for _ in range(5):
+        client.get("/api/v1/nodes/node-1")
+
+    assert len(server.requests) == 5
+    assert server.connections == 1
+
+    # a new connection is made after the previous one is closed
+    client.close()
+    client.get("/api/v1/nodes/node-1")
+    assert server.connections == 2
+
+
+def test_client_error(server: FakeAPIServer, kubeconfig: Path):
+    client = kubeapi.Client(kubeconfig)
+    with pytest.raises(kubeapi.KubernetesError) as e:
+        client.get("/api/v1/nodes/node-2")
+
+    assert e.value.status == 404
+
+
+def test_client_create(server: FakeAPIServer, kubeconfig: Path):
+    server.responses["/api/v1/namespaces/kube-system/secrets"] = (201, {"kind": "Secret"})
+
+    client = kubeapi.Client(kubeconfig)
+    client.create("/api/v1/namespaces/kube-system/secrets", {"kind": "Secret"})
+
+    method, path, headers, body = server.requests[0]
+    assert (method, path, body) == (
+        "POST",
+        "/api/v1/namespaces/kube-system/secrets",
+        {"kind": "Secret"},
+    )
+    assert headers["Content-Type"] == "application/json"
+
+
+def test_client_apply_manifest(server: FakeAPIServer, kubeconfig: Path, tmp_path: Path):
+    manifest = tmp_path / "manifest.yaml"
+    manifest.write_text(
+        """
+---
+apiVersion: v1
+kind: ServiceAccount
+metadata:
+  name: sa
+  namespace: kube-system
+---
+apiVersion: rbac.authorization.k8s.io/v1
+kind: ClusterRole
+metadata:
+  name: role
+"""
+    )
+    query = "?fieldManager=microk8s-charm&force=true"
+    server.responses[f"/api/v1/namespaces/kube-system/serviceaccounts/sa{query}"] = (200, {})
+    server.responses[f"/apis/rbac.authorization.k8s.io/v1/clusterroles/role{query}"] = (200, {})
+
+    client = kubeapi.Client(kubeconfig)
+    client.apply_manifest(manifest)
+
+    assert [(r[0], r[1], r[2]["Content-Type"]) for r in server.requests] == [
+        (
+            "PATCH",
+            f"/api/v1/namespaces/kube-system/serviceaccounts/sa{query}",
+            "application/apply-patch+yaml",
+        ),
+        (
+            "PATCH",
+            f"/apis/rbac.authorization.k8s.io/v1/clusterroles/role{query}",
+            "application/apply-patch+yaml",
+        ),
+    ]
+    assert server.connections == 1
+
+
+def test_client_delete(server: FakeAPIServer, kubeconfig: Path):
+    server.responses["/api/v1/namespaces/kube-system/services/svc"] = (200, {})
+
+    client = kubeapi.Client(kubeconfig)
+    client.delete("/api/v1/namespaces/kube-system/services/svc")
+
+    # missing objects are ignored
+    client.delete("/api/v1/namespaces/kube-system/services/missing")
+
+    assert [(r[0], r[1]) for r in server.requests] == [
+        ("DELETE", "/api/v1/namespaces/kube-system/services/svc"),
+        ("DELETE", "/api/v1/namespaces/kube-system/services/missing"),
+    ]
+
+    server.responses["/api/v1/namespaces/kube-system/services/svc"] = (403, {"message": "no"})
+    with pytest.raises(kubeapi.KubernetesError):
+        client.delete("/api/v1/namespaces/kube-system/services/svc")
+
+
+def test_client_probe(server: FakeAPIServer, kubeconfig: Path):
+    client = kubeapi.Client(kubeconfig)
+
+    server.responses["/readyz"] = (500, "not ready")
+    assert not client.probe("/readyz")
+
+    server.responses["/readyz"] = (200, "ok")
+    assert client.probe("/readyz")
+
+    server.responses["/readyz"] = (403, "forbidden")
+    with pytest.raises(kubeapi.KubernetesError):
+        client.probe("/readyz")
+
+
+def test_client_invalid_kubeconfig(tmp_path: Path):
+    with pytest.raises(OSError):
+        kubeapi.Client(tmp_path / "missing")
+
+    (tmp_path / "invalid").write_text("not: a kubeconfig")
+    with pytest.raises(ValueError):
+        kubeapi.Client(tmp_path / "invalid")
+
+
+def test_object_path():
+    with pytest.raises(ValueError):
+        kubeapi.object_path({"apiVersion": "v1", "kind": "Unknown", "metadata": {"name": "n"}})
+
+    assert (
+        kubeapi.object_path({"apiVersion": "v1", "kind": "Service", "metadata": {"name": "n"}})
+        == "/api/v1/namespaces/default/services/n"
+    )
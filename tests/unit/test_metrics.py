@@ -1,75 +1,213 @@
 #
 # Copyright 2023 Canonical, Ltd.
 #
+import json
+import re
 import subprocess
+import sys
+from base64 import b64decode
 from pathlib import Path
+from typing import Dict, List, Set, Tuple
 from unittest import mock
 
 import pytest
+import yaml
 
+import kubeapi
 import metrics
 
+ROOT = Path(__file__).parent.parent.parent
 
-@mock.patch("util.ensure_call")
+
+@mock.patch("kubeapi.get_client")
 @mock.patch("util.charm_dir")
-def test_apply_required_resources(charm_dir: mock.MagicMock, ensure_call: mock.MagicMock):
-    charm_dir.return_value = Path("dir")
-    metrics.apply_required_resources()
+@mock.patch("microk8s.snap_data_dir")
+def test_apply_required_resources(
+    snap_data_dir: mock.MagicMock, charm_dir: mock.MagicMock, get_client: mock.MagicMock
+):
+    snap_data_dir.return_value = Path("snapdatadir")
+    charm_dir.return_value = ROOT
+    metrics.apply_required_resources("proxy", 1)
 
-    assert ensure_call.mock_calls == [
-        mock.call(["microk8s", "kubectl", "apply", "-f", "dir/src/deploy/metrics.yaml"]),
-        mock.call(["microk8s", "kubectl", "apply", "-f", "dir/src/deploy/kube-state-metrics.yaml"]),
+    client = get_client.return_value
+    get_client.assert_called_once_with(Path("snapdatadir/credentials/client.config"))
+    client.apply_manifest.assert_called_once_with(ROOT / "src" / "deploy" / "metrics.yaml")
+    assert [obj["kind"] for obj in map(lambda c: c.args[0], client.apply.mock_calls)] == [
+        "ClusterRoleBinding",
+        "ClusterRole",
+        "Deployment",
+        "ServiceAccount",
+        "Service",
+    ]
+    deleted = [c.args[0] for c in client.delete.mock_calls]
+    assert "/apis/apps/v1/namespaces/kube-system/statefulsets/kube-state-metrics" in deleted
+    assert "/api/v1/namespaces/kube-system/services/kube-state-metrics-nodeport" in deleted
+    assert "/api/v1/namespaces/kube-system/services/kube-state-metrics-shard-0" in deleted
+    client.create.assert_not_called()
+
+
+@mock.patch("metrics._sign_certificate")
+@mock.patch("kubeapi.get_client")
+@mock.patch("util.charm_dir")
+@mock.patch("microk8s.snap_data_dir")
+def test_apply_required_resources_nodeport(
+    snap_data_dir: mock.MagicMock,
+    charm_dir: mock.MagicMock,
+    get_client: mock.MagicMock,
+    sign_certificate: mock.MagicMock,
+    tmp_path: Path,
+):
+    snap_data_dir.return_value = tmp_path
+    charm_dir.return_value = tmp_path
+    (tmp_path / "src").symlink_to(ROOT / "src")
+    (tmp_path / "certs").mkdir()
+    (tmp_path / "certs" / "ca.crt").write_text("fakeca")
+    (tmp_path / "kube-state-metrics.crt").write_text("fakecrt")
+    (tmp_path / "kube-state-metrics.key").write_text("fakekey")
+
+    client = get_client.return_value
+    client.get.side_effect = kubeapi.KubernetesError(404, "not found")
+    metrics.apply_required_resources("nodeport", 1)
+
+    # serving certificate
+    sign_certificate.assert_called_once_with(
+        "/CN=kube-state-metrics",
+        tmp_path / "kube-state-metrics.key",
+        tmp_path / "kube-state-metrics.crt",
+    )
+    path, secret = client.create.call_args.args
+    assert path == "/api/v1/namespaces/kube-system/secrets"
+    assert secret["metadata"]["name"] == "kube-state-metrics-tls"
+    assert b64decode(secret["data"]["ca.crt"]) == b"fakeca"
+    assert b"RequireAndVerifyClientCert" in b64decode(secret["data"]["web-config.yaml"])
+
+    # deployment serves over tls, service exposes a node port
+    objs = {obj["kind"]: obj for obj in map(lambda c: c.args[0], client.apply.mock_calls)}
+    container = objs["Deployment"]["spec"]["template"]["spec"]["containers"][0]
+    assert container["args"] == ["--tls-config=/etc/kube-state-metrics/web-config.yaml"]
+    assert container["livenessProbe"]["tcpSocket"] == {"port": 8080}
+    assert objs["Service"]["metadata"]["name"] == "kube-state-metrics-nodeport"
+    assert objs["Service"]["spec"]["ports"][0]["nodePort"] == 31880
+    deleted = [c.args[0] for c in client.delete.mock_calls]
+    assert "/api/v1/namespaces/kube-system/services/kube-state-metrics-nodeport" not in deleted
+
+    # existing certificate is not replaced
+    client.reset_mock()
+    sign_certificate.reset_mock()
+    client.get.side_effect = None
+    metrics.apply_required_resources("nodeport", 1)
+    sign_certificate.assert_not_called()
+    client.create.assert_not_called()
+
+
+@pytest.mark.parametrize("endpoint", ["proxy", "nodeport"])
+@mock.patch("kubeapi.get_client")
+@mock.patch("util.charm_dir")
+@mock.patch("microk8s.snap_data_dir")
+def test_apply_required_resources_sharded(
+    snap_data_dir: mock.MagicMock,
+    charm_dir: mock.MagicMock,
+    get_client: mock.MagicMock,
+    endpoint: str,
+):
+    snap_data_dir.return_value = Path("snapdatadir")
+    charm_dir.return_value = ROOT
+    metrics.apply_required_resources(endpoint, 3)
+
+    client = get_client.return_value
+    objs = [c.args[0] for c in client.apply.mock_calls]
+    kinds = [obj["kind"] for obj in objs]
+    assert "Deployment" not in kinds
+
+    # statefulset with automatic sharding
+    sts = next(obj for obj in objs if obj["kind"] == "StatefulSet")
+    assert sts["metadata"]["name"] == "kube-state-metrics"
+    assert sts["spec"]["replicas"] == 3
+    assert sts["spec"]["serviceName"] == "kube-state-metrics"
+    container = sts["spec"]["template"]["spec"]["containers"][0]
+    assert "--pod=$(POD_NAME)" in container["args"]
+    assert "--pod-namespace=$(POD_NAMESPACE)" in container["args"]
+    assert {env["name"] for env in container["env"]} == {"POD_NAME", "POD_NAMESPACE"}
+
+    # every shard can be scraped through the pod proxy
+    role = next(
+        obj
+        for obj in objs
+        if obj["kind"] == "Role"
+        and obj["metadata"]["name"] == "microk8s-observability-kube-state-metrics"
+    )
+    assert role["rules"][0]["resourceNames"] == [
+        "kube-state-metrics-0:8080",
+        "kube-state-metrics-1:8080",
+        "kube-state-metrics-2:8080",
     ]
 
+    # every shard has its own node port
+    services = {
+        obj["metadata"]["name"]: obj
+        for obj in objs
+        if obj["kind"] == "Service" and obj["spec"].get("type") == "NodePort"
+    }
+    if endpoint == "nodeport":
+        assert sorted(services) == [f"kube-state-metrics-shard-{i}" for i in range(3)]
+        svc = services["kube-state-metrics-shard-2"]
+        assert svc["spec"]["ports"][0]["nodePort"] == 31882
+        assert (
+            svc["spec"]["selector"]["statefulset.kubernetes.io/pod-name"] == "kube-state-metrics-2"
+        )
+    else:
+        assert not services
+
+    deleted = [c.args[0] for c in client.delete.mock_calls]
+    assert "/apis/apps/v1/namespaces/kube-system/deployments/kube-state-metrics" in deleted
+    assert "/api/v1/namespaces/kube-system/services/kube-state-metrics-nodeport" in deleted
+    assert "/api/v1/namespaces/kube-system/services/kube-state-metrics-shard-3" in deleted
+    assert ("/api/v1/namespaces/kube-system/services/kube-state-metrics-shard-2" in deleted) == (
+        endpoint == "proxy"
+    )
+
 
-@mock.patch("util.run")
-def test_get_tls_auth_existing_secret(run: mock.MagicMock):
-    run.return_value.stdout = b'{"data": {"tls.crt": "ZmFrZWNydA==", "tls.key": "ZmFrZWtleQ=="}}'
+@mock.patch("kubeapi.get_client")
+def test_get_tls_auth_existing_secret(get_client: mock.MagicMock):
+    get_client.return_value.get.return_value = {
+        "data": {"tls.crt": "ZmFrZWNydA==", "tls.key": "ZmFrZWtleQ=="}
+    }
 
     crt, key = metrics.get_tls_auth()
     assert crt == "fakecrt"
     assert key == "fakekey"
 
-    run.assert_called_once_with(
-        [
-            "microk8s",
-            "kubectl",
-            "get",
-            "secret",
-            "--namespace=kube-system",
-            "microk8s-observability-tls",
-            "-o=json",
-        ],
-        capture_output=True,
+    get_client.return_value.get.assert_called_once_with(
+        "/api/v1/namespaces/kube-system/secrets/microk8s-observability-tls"
     )
 
 
 @mock.patch("util.ensure_call")
-@mock.patch("util.run")
+@mock.patch("kubeapi.get_client")
 @mock.patch("util.charm_dir")
 @mock.patch("microk8s.snap_data_dir")
 def test_get_tls_auth_create_secret(
     snap_data_dir: mock.MagicMock,
     charm_dir: mock.MagicMock,
-    run: mock.MagicMock,
+    get_client: mock.MagicMock,
     ensure_call: mock.MagicMock,
+    tmp_path: Path,
 ):
     snap_data_dir.return_value = Path("snapdatadir")
-    charm_dir.return_value = Path("charmdir")
-    run.side_effect = [
-        subprocess.CalledProcessError(1, "fakeerr"),
-        subprocess.CompletedProcess(
-            args=[],
-            returncode=0,
-            stdout=b'{"data": {"tls.crt": "ZmFrZWNydA==", "tls.key": "ZmFrZWtleQ=="}}',
-        ),
+    charm_dir.return_value = tmp_path
+    (tmp_path / "metrics.crt").write_text("fakecrt")
+    (tmp_path / "metrics.key").write_text("fakekey")
+
+    client = get_client.return_value
+    client.get.side_effect = [
+        kubeapi.KubernetesError(404, "not found"),
+        {"data": {"tls.crt": "ZmFrZWNydA==", "tls.key": "ZmFrZWtleQ=="}},
     ]
 
     ensure_call.side_effect = [
         None,
         subprocess.CompletedProcess(args=[], returncode=0, stdout=b"fakecsr"),
         None,
-        None,
     ]
 
     crt, key = metrics.get_tls_auth()
@@ -77,7 +215,7 @@ def test_get_tls_auth_create_secret(
     assert key == "fakekey"
 
     assert ensure_call.mock_calls == [
-        mock.call(["openssl", "genrsa", "-out", "charmdir/metrics.key", "2048"]),
+        mock.call(["openssl", "genrsa", "-out", f"{tmp_path}/metrics.key", "2048"]),
         mock.call(
             [
                 "openssl",
@@ -86,7 +224,7 @@ def test_get_tls_auth_create_secret(
                 "-subj",
                 "/CN=system:serviceaccount:kube-system:microk8s-observability",
                 "-key",
-                "charmdir/metrics.key",
+                f"{tmp_path}/metrics.key",
             ],
             capture_output=True,
         ),
@@ -104,26 +242,21 @@ def test_get_tls_auth_create_secret(
                 "-days",
                 "3650",
                 "-out",
-                "charmdir/metrics.crt",
+                f"{tmp_path}/metrics.crt",
             ],
             input=b"fakecsr",
         ),
-        mock.call(
-            [
-                "microk8s",
-                "kubectl",
-                "create",
-                "secret",
-                "tls",
-                "microk8s-observability-tls",
-                "--namespace=kube-system",
-                "--cert",
-                "charmdir/metrics.crt",
-                "--key",
-                "charmdir/metrics.key",
-            ]
-        ),
     ]
+    client.create.assert_called_once_with(
+        "/api/v1/namespaces/kube-system/secrets",
+        {
+            "apiVersion": "v1",
+            "kind": "Secret",
+            "type": "kubernetes.io/tls",
+            "metadata": {"name": "microk8s-observability-tls", "namespace": "kube-system"},
+            "data": {"tls.crt": "ZmFrZWNydA==", "tls.key": "ZmFrZWtleQ=="},
+        },
+    )
 
 
 @pytest.mark.parametrize(
@@ -132,17 +265,6 @@ def test_get_tls_auth_create_secret(
         (
             False,
             [
-                {
-                    "scheme": "https",
-                    "tls_config": {
-                        "insecure_skip_verify": True,
-                        "cert": "fakecrt",
-                        "key": "fakekey",
-                    },
-                    "job_name": "kube-proxy",
-                    "static_configs": [{"targets": ["localhost:10250"]}],
-                    "relabel_configs": [{"target_label": "job", "replacement": "kube-proxy"}],
-                },
                 {
                     "scheme": "https",
                     "tls_config": {
@@ -159,6 +281,14 @@ def test_get_tls_auth_create_secret(
                         {"target_label": "metrics_path", "replacement": "/metrics"},
                         {"target_label": "job", "replacement": "kubelet"},
                     ],
+                    "metric_relabel_configs": [
+                        {
+                            "source_labels": ["__name__"],
+                            "regex": "(kubeproxy)_.+",
+                            "target_label": "job",
+                            "replacement": "kube-proxy",
+                        },
+                    ],
                 },
                 {
                     "scheme": "https",
@@ -194,6 +324,13 @@ def test_get_tls_auth_create_secret(
                         {"target_label": "job", "replacement": "kubelet"},
                     ],
                 },
+                {
+                    "job_name": "microk8s-charm",
+                    "static_configs": [
+                        {"targets": ["localhost:19380"], "labels": {"node": "nodename"}}
+                    ],
+                    "relabel_configs": [{"target_label": "job", "replacement": "microk8s-charm"}],
+                },
             ],
         ),
         (
@@ -209,29 +346,19 @@ def test_get_tls_auth_create_secret(
                     "job_name": "apiserver",
                     "static_configs": [{"targets": ["localhost:16443"]}],
                     "relabel_configs": [{"target_label": "job", "replacement": "apiserver"}],
-                },
-                {
-                    "scheme": "https",
-                    "tls_config": {
-                        "insecure_skip_verify": True,
-                        "cert": "fakecrt",
-                        "key": "fakekey",
-                    },
-                    "job_name": "kube-scheduler",
-                    "static_configs": [{"targets": ["localhost:16443"]}],
-                    "relabel_configs": [{"target_label": "job", "replacement": "kube-scheduler"}],
-                },
-                {
-                    "scheme": "https",
-                    "tls_config": {
-                        "insecure_skip_verify": True,
-                        "cert": "fakecrt",
-                        "key": "fakekey",
-                    },
-                    "job_name": "kube-controller-manager",
-                    "static_configs": [{"targets": ["localhost:16443"]}],
-                    "relabel_configs": [
-                        {"target_label": "job", "replacement": "kube-controller-manager"}
+                    "metric_relabel_configs": [
+                        {
+                            "source_labels": ["__name__"],
+                            "regex": "(scheduler)_.+",
+                            "target_label": "job",
+                            "replacement": "kube-scheduler",
+                        },
+                        {
+                            "source_labels": ["__name__"],
+                            "regex": mock.ANY,
+                            "target_label": "job",
+                            "replacement": "kube-controller-manager",
+                        },
                     ],
                 },
                 {
@@ -248,17 +375,6 @@ def test_get_tls_auth_create_secret(
                         {"target_label": "job", "replacement": "kube-state-metrics"}
                     ],
                 },
-                {
-                    "scheme": "https",
-                    "tls_config": {
-                        "insecure_skip_verify": True,
-                        "cert": "fakecrt",
-                        "key": "fakekey",
-                    },
-                    "job_name": "kube-proxy",
-                    "static_configs": [{"targets": ["localhost:10250"]}],
-                    "relabel_configs": [{"target_label": "job", "replacement": "kube-proxy"}],
-                },
                 {
                     "scheme": "https",
                     "tls_config": {
@@ -275,6 +391,14 @@ def test_get_tls_auth_create_secret(
                         {"target_label": "metrics_path", "replacement": "/metrics"},
                         {"target_label": "job", "replacement": "kubelet"},
                     ],
+                    "metric_relabel_configs": [
+                        {
+                            "source_labels": ["__name__"],
+                            "regex": "(kubeproxy)_.+",
+                            "target_label": "job",
+                            "replacement": "kube-proxy",
+                        },
+                    ],
                 },
                 {
                     "scheme": "https",
@@ -310,11 +434,331 @@ def test_get_tls_auth_create_secret(
                         {"target_label": "job", "replacement": "kubelet"},
                     ],
                 },
+                {
+                    "job_name": "microk8s-charm",
+                    "static_configs": [
+                        {"targets": ["localhost:19380"], "labels": {"node": "nodename"}}
+                    ],
+                    "relabel_configs": [{"target_label": "job", "replacement": "microk8s-charm"}],
+                },
             ],
         ),
     ],
 )
 def test_build_scrape_jobs(control_plane: bool, expected_jobs: list):
     assert (
-        metrics.build_scrape_jobs("fakecrt", "fakekey", control_plane, "nodename") == expected_jobs
+        metrics.build_scrape_jobs("fakecrt", "fakekey", control_plane, "nodename", True)
+        == expected_jobs
     )
+
+
+@mock.patch("util.ensure_call")
+@mock.patch("util.ensure_file")
+@mock.patch("util.charm_dir")
+def test_install_exporter(
+    charm_dir: mock.MagicMock, ensure_file: mock.MagicMock, ensure_call: mock.MagicMock
+):
+    charm_dir.return_value = Path("/charm")
+
+    ensure_file.return_value = True
+    metrics.install_exporter()
+
+    path, unit, *_ = ensure_file.call_args[0]
+    assert path == Path("/etc/systemd/system/microk8s-charm-exporter.service")
+    assert (
+        "ExecStart=/usr/bin/python3 /charm/src/exporter.py "
+        "--directory /charm/instrumentation --port 19380" in unit
+    )
+    assert ensure_call.mock_calls == [
+        mock.call(["systemctl", "daemon-reload"]),
+        mock.call(["systemctl", "enable", "--now", "microk8s-charm-exporter"]),
+    ]
+
+    # unchanged unit file
+    ensure_file.return_value = False
+    ensure_call.reset_mock()
+    metrics.install_exporter()
+    ensure_call.assert_not_called()
+
+    metrics.install_exporter(restart=True)
+    ensure_call.assert_called_once_with(["systemctl", "restart", "microk8s-charm-exporter"])
+
+
+@pytest.mark.parametrize("control_plane", [True, False])
+def test_build_scrape_jobs_kube_state_metrics(control_plane: bool):
+    jobs = metrics.build_scrape_jobs("fakecrt", "fakekey", control_plane, "nodename", False)
+    assert "kube-state-metrics" not in [job["job_name"] for job in jobs]
+
+    jobs = metrics.build_scrape_jobs("fakecrt", "fakekey", control_plane, "nodename", True)
+    assert ("kube-state-metrics" in [job["job_name"] for job in jobs]) == control_plane
+
+
+def test_build_scrape_jobs_kube_state_metrics_nodeport():
+    jobs = metrics.build_scrape_jobs("fakecrt", "fakekey", True, "nodename", True, "nodeport")
+    job = next(job for job in jobs if job["job_name"] == "kube-state-metrics")
+
+    assert "metrics_path" not in job
+    assert job["static_configs"] == [{"targets": ["localhost:31880"]}]
+    assert job["tls_config"] == {
+        "insecure_skip_verify": True,
+        "cert": "fakecrt",
+        "key": "fakekey",
+    }
+
+
+def test_build_scrape_jobs_kube_state_metrics_sharded():
+    jobs = metrics.build_scrape_jobs("fakecrt", "fakekey", True, "nodename", True, "proxy", 2)
+    job = next(job for job in jobs if job["job_name"] == "kube-state-metrics")
+
+    assert "metrics_path" not in job
+    assert job["static_configs"] == [
+        {
+            "targets": ["localhost:16443"],
+            "labels": {
+                "__metrics_path__": f"/api/v1/namespaces/kube-system/pods/kube-state-metrics-{i}:8080/proxy/metrics",  # noqa
+                "shard": str(i),
+            },
+        }
+        for i in range(2)
+    ]
+
+    jobs = metrics.build_scrape_jobs("fakecrt", "fakekey", True, "nodename", True, "nodeport", 2)
+    job = next(job for job in jobs if job["job_name"] == "kube-state-metrics")
+
+    assert job["static_configs"] == [
+        {"targets": ["localhost:31880"], "labels": {"shard": "0"}},
+        {"targets": ["localhost:31881"], "labels": {"shard": "1"}},
+    ]
+
+
+def _queries(dashboards: bool = True) -> List[Tuple[str, str]]:
+    """return (metric, job) for all metrics queried with a job label by the alert rules and,
+    optionally, the dashboards"""
+    exprs = []
+
+    def walk(obj):
+        if isinstance(obj, dict):
+            exprs.extend(v for k, v in obj.items() if k == "expr" and isinstance(v, str))
+            for v in obj.values():
+                walk(v)
+        elif isinstance(obj, list):
+            for v in obj:
+                walk(v)
+
+    for file in (ROOT / "src" / "grafana_dashboards").glob("*.json") if dashboards else []:
+        walk(json.loads(file.read_text()))
+    for file in (ROOT / "src" / "prometheus_alert_rules").glob("*.yaml"):
+        walk(yaml.safe_load(file.read_text()))
+
+    queries = set()
+    for expr in exprs:
+        for metric, selector in re.findall(r"([a-zA-Z_:][a-zA-Z0-9_:]*)\{([^}]*)\}", expr):
+            if job := re.search(r'job="([^"]*)"', selector):
+                queries.add((metric, job.group(1)))
+
+    return sorted(queries)
+
+
+def _recorded() -> Set[Tuple[str, str]]:
+    """return (metric, job) for all metrics copied to a job by the microk8s recording rules"""
+    rules = yaml.safe_load((ROOT / "src/prometheus_alert_rules/microk8s-kubelite.yaml").read_text())
+    recorded = set()
+    for group in rules["groups"]:
+        for rule in group["rules"]:
+            recorded.add((rule["record"], re.search(r'"job", "([^"]*)"', rule["expr"]).group(1)))
+    return recorded
+
+
+@pytest.mark.parametrize("job", ["kube-scheduler", "kube-controller-manager", "kube-proxy"])
+def test_split_jobs_queries(job: str):
+    """metrics queried by the dashboards and alert rules must be routed or copied to their job"""
+    regex = next(
+        c["regex"]
+        for scrape_job in metrics.build_scrape_jobs("fakecrt", "fakekey", True, "nodename", True)
+        for c in scrape_job.get("metric_relabel_configs", [])
+        if c["replacement"] == job
+    )
+
+    for metric, query_job in _queries():
+        if query_job == job:
+            assert re.fullmatch(regex, metric) or (metric, job) in _recorded(), metric
+
+
+# scrape jobs that ingest the metrics of each job label
+SCRAPE_JOBS = {
+    "apiserver": ["apiserver"],
+    "kube-controller-manager": ["apiserver"],
+    "kube-proxy": ["kubelet"],
+    "kube-scheduler": ["apiserver"],
+    "kube-state-metrics": ["kube-state-metrics"],
+    "kubelet": ["kubelet", "kubelet-cadvisor", "kubelet-probes"],
+}
+
+
+def _ingested(scrape_job: Dict, metric: str) -> bool:
+    """return True if the metric relabel configs of the scrape job keep the metric"""
+    for c in scrape_job.get("metric_relabel_configs", []):
+        if c.get("action") == "keep" and not re.fullmatch(c["regex"], metric):
+            return False
+        if c.get("action") == "drop" and re.fullmatch(c["regex"], metric):
+            return False
+    return True
+
+
+@pytest.mark.parametrize("profile", metrics.METRICS_PROFILES)
+def test_build_scrape_jobs_metrics_profile(profile: str):
+    """metrics queried by the alert rules (and dashboards, unless "minimal") must be ingested"""
+    jobs = metrics.build_scrape_jobs(
+        "fakecrt", "fakekey", True, "nodename", True, metrics_profile=profile
+    )
+    jobs = {job["job_name"]: job for job in jobs}
+
+    for metric, job in _queries(dashboards=profile != "minimal"):
+        if job in SCRAPE_JOBS and (metric, job) not in _recorded() and metric != "up":
+            assert any(
+                _ingested(jobs[scrape_job], metric)
+                for scrape_job in SCRAPE_JOBS[job]
+                if scrape_job in jobs
+            ), (metric, job)
+
+
+def test_build_scrape_jobs_metrics_profile_drop():
+    jobs = {
+        profile: {
+            job["job_name"]: job
+            for job in metrics.build_scrape_jobs(
+                "fakecrt", "fakekey", True, "nodename", True, metrics_profile=profile
+            )
+        }
+        for profile in metrics.METRICS_PROFILES
+    }
+
+    # nothing uses the probe metrics
+    assert "kubelet-probes" in jobs["full"]
+    assert "kubelet-probes" not in jobs["standard"]
+
+    for profile, job, metric, ingested in [
+        ("full", "apiserver", "apiserver_request_duration_seconds_bucket", True),
+        ("standard", "apiserver", "apiserver_request_duration_seconds_bucket", False),
+        ("standard", "apiserver", "apiserver_request_slo_duration_seconds_bucket", True),
+        ("full", "kubelet-cadvisor", "container_blkio_device_usage_total", True),
+        ("standard", "kubelet-cadvisor", "container_blkio_device_usage_total", False),
+        ("standard", "kubelet-cadvisor", "container_network_receive_bytes_total", True),
+        ("minimal", "kubelet-cadvisor", "container_network_receive_bytes_total", False),
+        ("minimal", "kubelet-cadvisor", "container_memory_working_set_bytes", True),
+        ("standard", "kube-state-metrics", "kube_pod_labels", False),
+        ("standard", "kube-state-metrics", "kube_pod_info", True),
+    ]:
+        assert _ingested(jobs[profile][job], metric) == ingested, (profile, job, metric)
+
+    # jobs are still split by metric name
+    for profile in metrics.METRICS_PROFILES:
+        assert jobs[profile]["apiserver"]["metric_relabel_configs"][-2:] == metrics._route_jobs(
+            metrics.CONTROL_PLANE_JOB_PREFIXES
+        )
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("", {}),
+        ("{}", {}),
+        (
+            '{"cadvisor": {"interval": "2m", "timeout": "90s"}, "probes": {"interval": "5m"}}',
+            {
+                "kubelet-cadvisor": {"scrape_interval": "2m", "scrape_timeout": "90s"},
+                "kubelet-probes": {"scrape_interval": "5m", "scrape_timeout": "10s"},
+            },
+        ),
+        (
+            '{"kube-state-metrics": {"interval": "1m30s", "timeout": "1m"}}',
+            {"kube-state-metrics": {"scrape_interval": "1m30s", "scrape_timeout": "1m"}},
+        ),
+        (
+            '{"apiserver": {"timeout": "500ms"}}',
+            {"apiserver": {"scrape_interval": "1m", "scrape_timeout": "500ms"}},
+        ),
+        # the default timeout is capped to the interval
+        (
+            '{"kubelet": {"interval": "5s"}}',
+            {"kubelet": {"scrape_interval": "5s", "scrape_timeout": "5s"}},
+        ),
+        (
+            '{"kubelet": {"interval": "30s", "timeout": "30s"}}',
+            {"kubelet": {"scrape_interval": "30s", "scrape_timeout": "30s"}},
+        ),
+        # all Prometheus duration units
+        (
+            '{"probes": {"interval": "1y2w3d", "timeout": "1d12h"}}',
+            {"kubelet-probes": {"scrape_interval": "1y2w3d", "scrape_timeout": "1d12h"}},
+        ),
+        (
+            '{"cadvisor": {"interval": "1w", "timeout": "1h1m1s1ms"}}',
+            {"kubelet-cadvisor": {"scrape_interval": "1w", "scrape_timeout": "1h1m1s1ms"}},
+        ),
+    ],
+)
+def test_parse_scrape_intervals(value: str, expected: dict):
+    assert metrics.parse_scrape_intervals(value) == expected
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "not json",
+        "[]",
+        '{"proxy": {"interval": "1m"}}',
+        '{"kubelet": "1m"}',
+        '{"kubelet": {"period": "1m"}}',
+        '{"kubelet": {"interval": 60}}',
+        '{"kubelet": {"interval": "1 minute"}}',
+        '{"kubelet": {"interval": "30s", "timeout": "31s"}}',
+        '{"kubelet": {"interval": "1d", "timeout": "1w"}}',
+        '{"kubelet": {"interval": "1h1y"}}',
+        '{"kubelet": {"interval": "0s"}}',
+        '{"kubelet": {"timeout": "0s"}}',
+    ],
+)
+def test_parse_scrape_intervals_invalid(value: str):
+    with pytest.raises(ValueError):
+        metrics.parse_scrape_intervals(value)
+
+
+def test_build_scrape_jobs_scrape_intervals():
+    intervals = metrics.parse_scrape_intervals(
+        '{"cadvisor": {"interval": "2m", "timeout": "90s"}, "kube-state-metrics": {}}'
+    )
+    jobs = metrics.build_scrape_jobs(
+        "fakecrt", "fakekey", True, "nodename", True, scrape_intervals=intervals
+    )
+    jobs = {job["job_name"]: job for job in jobs}
+
+    assert jobs["kubelet-cadvisor"]["scrape_interval"] == "2m"
+    assert jobs["kubelet-cadvisor"]["scrape_timeout"] == "90s"
+    assert jobs["kube-state-metrics"]["scrape_interval"] == "1m"
+    assert jobs["kube-state-metrics"]["scrape_timeout"] == "10s"
+    for name in ["apiserver", "kubelet", "kubelet-probes", "microk8s-charm"]:
+        assert "scrape_interval" not in jobs[name]
+        assert "scrape_timeout" not in jobs[name]
+
+
+def test_metrics_index():
+    """the metrics index must match the bundled dashboards and alert rules"""
+    p = subprocess.run(
+        [sys.executable, "src/hack/update_metrics_index.py", "--check"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    assert p.returncode == 0, p.stderr
+
+    index = json.loads((ROOT / "src" / metrics.METRICS_INDEX).read_text())
+    assert ["kube-state-metrics", ""] in index["alert_rules"]["kube_pod_info"]
+    assert ["kubelet", "/metrics/cadvisor"] in index["dashboards"]["container_memory_rss"]
+
+    # recording rules, synthetic series, label names and comments are not metrics
+    for source in index.values():
+        assert not any(":" in name for name in source)
+        assert "up" not in source
+        assert "namespace" not in source
+        assert "slow" not in source
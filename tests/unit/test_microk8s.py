@@ -8,6 +8,7 @@ import pytest
 from ops.model import ActiveStatus, MaintenanceStatus, WaitingStatus
 
 import charm_config
+import kubeapi
 import microk8s
 
 
@@ -33,8 +34,56 @@ def test_microk8s_uninstall(ensure_call: mock.MagicMock):
     ensure_call.assert_called_once_with(["snap", "remove", "microk8s", "--purge"])
 
 
+@mock.patch("time.sleep")
 @mock.patch("util.ensure_call")
-def test_microk8s_wait_ready(ensure_call: mock.MagicMock):
+@mock.patch("microk8s._kubelet_healthy")
+@mock.patch("kubeapi.get_client")
+def test_microk8s_wait_ready(
+    get_client: mock.MagicMock,
+    kubelet_healthy: mock.MagicMock,
+    ensure_call: mock.MagicMock,
+    sleep: mock.MagicMock,
+):
+    get_client.return_value.probe.side_effect = [ConnectionRefusedError(), False, True, True]
+    kubelet_healthy.side_effect = [False, True]
+
+    microk8s.wait_ready(timeout=5)
+
+    get_client.assert_called_once_with(
+        Path("/var/snap/microk8s/current/credentials/kubelet.config")
+    )
+    assert get_client.return_value.probe.mock_calls == [mock.call("/readyz")] * 4
+    assert sleep.mock_calls == [mock.call(0.1), mock.call(0.2), mock.call(0.4)]
+    ensure_call.assert_not_called()
+
+
+@mock.patch("microk8s.time")
+@mock.patch("util.ensure_call")
+@mock.patch("kubeapi.get_client")
+def test_microk8s_wait_ready_timeout(
+    get_client: mock.MagicMock, ensure_call: mock.MagicMock, time: mock.MagicMock
+):
+    time.monotonic.side_effect = [0, 1, 2, 4.8]
+    get_client.return_value.probe.return_value = False
+
+    with pytest.raises(TimeoutError):
+        microk8s.wait_ready(timeout=5)
+
+    assert time.sleep.mock_calls == [mock.call(0.1), mock.call(0.2)]
+    ensure_call.assert_not_called()
+
+
+@mock.patch("util.ensure_call")
+@mock.patch("kubeapi.get_client")
+@pytest.mark.parametrize(
+    "error", [FileNotFoundError(), ValueError(), kubeapi.KubernetesError(403, "forbidden")]
+)
+def test_microk8s_wait_ready_fallback(
+    get_client: mock.MagicMock, ensure_call: mock.MagicMock, error: Exception
+):
+    get_client.return_value.probe.side_effect = error
+    get_client.side_effect = error if isinstance(error, (OSError, ValueError)) else None
+
     microk8s.wait_ready(timeout=5)
     ensure_call.assert_called_once_with(
         ["microk8s", "status", "--wait-ready", "--timeout=5"], capture_output=True
@@ -73,31 +122,27 @@ def test_microk8s_add_node(urandom: mock.MagicMock, ensure_call: mock.MagicMock)
 
 
 STATUS_MESSAGES = {
-    "NOT_READY_STATUS": """
-{
-    "lastHeartbeatTime": "2023-05-12T05:54:05Z",
-    "lastTransitionTime": "2023-05-12T05:54:05Z",
-    "message": "[container runtime network not ready: NetworkReady=false reason:NetworkPluginNotReady message:Network plugin returns error: cni plugin not initialized, CSINode is not yet initialized]",
-    "reason": "KubeletNotReady",
-    "status": "False",
-    "type": "Ready"
-}
-""",  # noqa
-    "READY_STATUS": """
-{
-    "lastHeartbeatTime": "2023-05-12T05:54:22Z",
-    "lastTransitionTime": "2023-05-12T05:54:22Z",
-    "message": "kubelet is posting ready status. AppArmor enabled",
-    "reason": "KubeletReady",
-    "status": "True",
-    "type": "Ready"
-}
-""",
-    "INVALID_STATUS": """not a json message""",
+    "NOT_READY_STATUS": {
+        "lastHeartbeatTime": "2023-05-12T05:54:05Z",
+        "lastTransitionTime": "2023-05-12T05:54:05Z",
+        "message": "[container runtime network not ready: NetworkReady=false reason:NetworkPluginNotReady message:Network plugin returns error: cni plugin not initialized, CSINode is not yet initialized]",  # noqa
+        "reason": "KubeletNotReady",
+        "status": "False",
+        "type": "Ready",
+    },
+    "READY_STATUS": {
+        "lastHeartbeatTime": "2023-05-12T05:54:22Z",
+        "lastTransitionTime": "2023-05-12T05:54:22Z",
+        "message": "kubelet is posting ready status. AppArmor enabled",
+        "reason": "KubeletReady",
+        "status": "True",
+        "type": "Ready",
+    },
+    "INVALID_STATUS": {"message": "not a ready condition"},
 }
 
 
-@mock.patch("util.run")
+@mock.patch("kubeapi.get_client")
 @pytest.mark.parametrize(
     "message, expect_status",
     [
@@ -106,25 +151,29 @@ STATUS_MESSAGES = {
         ("INVALID_STATUS", MaintenanceStatus("waiting for node")),
     ],
 )
-def test_microk8s_get_unit_status(run: mock.MagicMock, message: str, expect_status):
-    run.return_value.stdout = STATUS_MESSAGES[message].encode()
+def test_microk8s_get_unit_status(get_client: mock.MagicMock, message: str, expect_status):
+    get_client.return_value.get.return_value = {
+        "status": {"conditions": [{"type": "MemoryPressure"}, STATUS_MESSAGES[message]]}
+    }
 
     status = microk8s.get_unit_status("node-1")
-    run.assert_called_once_with(
-        [
-            "/snap/microk8s/current/kubectl",
-            "--kubeconfig=/var/snap/microk8s/current/credentials/kubelet.config",
-            "get",
-            "node",
-            "node-1",
-            "-o",
-            "jsonpath={.status.conditions[?(@.type=='Ready')]}",
-        ],
-        capture_output=True,
+    get_client.assert_called_once_with(
+        Path("/var/snap/microk8s/current/credentials/kubelet.config")
     )
+    get_client.return_value.get.assert_called_once_with("/api/v1/nodes/node-1")
     assert status == expect_status
 
 
+@mock.patch("kubeapi.get_client")
+@pytest.mark.parametrize(
+    "error", [OSError("connection refused"), kubeapi.KubernetesError(404, "not found")]
+)
+def test_microk8s_get_unit_status_error(get_client: mock.MagicMock, error: Exception):
+    get_client.return_value.get.side_effect = error
+
+    assert microk8s.get_unit_status("node-1") == MaintenanceStatus("waiting for node")
+
+
 @mock.patch("microk8s.snap_data_dir", autospec=True)
 @mock.patch("util.ensure_file", autospec=True)
 @mock.patch("util.ensure_block", autospec=True)
@@ -207,14 +256,14 @@ def test_microk8s_configure_extra_sans(
     get_unit_public_address.return_value = "2.2.2.2"
 
     # no change when empty
-    microk8s.configure_extra_sans([])
+    assert not microk8s.configure_extra_sans([])
     ensure_file.assert_not_called()
     ensure_block.assert_not_called()
     ensure_call.assert_not_called()
     get_unit_public_address.assert_not_called()
 
     # change config and restart service if something changed
-    microk8s.configure_extra_sans("1.1.1.1,k8s.local")
+    assert microk8s.configure_extra_sans("1.1.1.1,k8s.local") == changed
 
     get_unit_public_address.assert_not_called()
     ensure_block.assert_called_once_with(
@@ -0,0 +1,83 @@
+#
+# Copyright 2023 Canonical, Ltd.
+#
+import os
+import tarfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+import profiling
+
+
+def test_parse_modes():
+    assert profiling.parse_modes("") == set()
+    assert profiling.parse_modes("cpu") == {"cpu"}
+    assert profiling.parse_modes(" cpu, memory ") == {"cpu", "memory"}
+
+    with pytest.raises(ValueError):
+        profiling.parse_modes("cpu,disk")
+
+
+@mock.patch.dict(os.environ, clear=True)
+def test_get_modes(tmp_path: Path):
+    assert profiling.get_modes(tmp_path) == set()
+
+    profiling.set_modes(tmp_path, {"memory", "cpu"})
+    assert (tmp_path / "enabled").read_text() == "cpu,memory"
+    assert profiling.get_modes(tmp_path) == {"cpu", "memory"}
+
+    # environment takes precedence
+    os.environ["MICROK8S_CHARM_PROFILE"] = "cpu"
+    assert profiling.get_modes(tmp_path) == {"cpu"}
+
+    del os.environ["MICROK8S_CHARM_PROFILE"]
+    profiling.set_modes(tmp_path, set())
+    assert not (tmp_path / "enabled").exists()
+    assert profiling.get_modes(tmp_path) == set()
+
+
+@mock.patch.dict(os.environ, {"MICROK8S_CHARM_PROFILE": ""})
+def test_run_disabled(tmp_path: Path):
+    assert profiling.run(lambda: "retval", tmp_path, "install") == "retval"
+    assert list(tmp_path.iterdir()) == []
+
+
+@mock.patch.dict(os.environ, {"MICROK8S_CHARM_PROFILE": "cpu,memory"})
+def test_run(tmp_path: Path):
+    assert profiling.run(lambda: sorted(range(1000)), tmp_path, "update-status")
+
+    files = profiling.latest(tmp_path, 1)
+    assert [file.suffix for file in files] == [".pstats", ".tracemalloc"]
+    assert files[0].stem.endswith("-update-status")
+
+    assert "cumulative" in profiling.summarize(files[0], 5)
+    profiling.summarize(files[1], 5)
+
+    profiling.archive(files, tmp_path / "profiles.tar.gz")
+    with tarfile.open(tmp_path / "profiles.tar.gz") as tar:
+        assert tar.getnames() == [file.name for file in files]
+
+
+@mock.patch.dict(os.environ, {"MICROK8S_CHARM_PROFILE": "cpu"})
+@mock.patch("profiling.MAX_PROFILES", 3)
+def test_run_rotate(tmp_path: Path):
+    for hook in ["install", "config-changed", "start", "update-status", "update-status"]:
+        profiling.run(lambda: None, tmp_path, hook)
+
+    assert len(list(tmp_path.glob("*.pstats"))) == 3
+
+    files = profiling.latest(tmp_path, 2)
+    assert [file.stem.split("-", 1)[1] for file in files] == ["update-status", "update-status"]
+
+
+@mock.patch.dict(os.environ, {"MICROK8S_CHARM_PROFILE": "cpu"})
+def test_run_exception(tmp_path: Path):
+    def fail():
+        raise RuntimeError("fake error")
+
+    with pytest.raises(RuntimeError):
+        profiling.run(fail, tmp_path, "install")
+
+    assert len(profiling.latest(tmp_path, 1)) == 1
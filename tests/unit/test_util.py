@@ -2,11 +2,13 @@
 # Copyright 2023 Canonical, Ltd.
 #
 import subprocess
+import sys
 from pathlib import Path
 from unittest import mock
 
 import pytest
 
+import kubeapi
 import util
 
 
@@ -104,14 +106,18 @@ def test_ensure_block(name: str, text: str, block: str, mark: str, expected: lis
     assert util.ensure_block(text, block, mark) == expected
 
 
+NO_JITTER = util.RetryPolicy(initial_delay=2, jitter=0, max_attempts=10, max_delay=20)
+
+
 @mock.patch("time.sleep")
 @mock.patch("subprocess.run")
 def test_ensure_call(run: mock.MagicMock, sleep: mock.MagicMock):
     # first time raises exception, second time succeeds
-    run.side_effect = (subprocess.CalledProcessError(1, "cmd"), "retval")
+    retval = subprocess.CompletedProcess(["echo"], 0)
+    run.side_effect = (subprocess.CalledProcessError(1, "cmd"), retval)
 
-    r = util.ensure_call(["echo"], env={"KEY": "VALUE"})
-    assert r == "retval"
+    r = util.ensure_call(["echo"], env={"KEY": "VALUE"}, retry_policy=NO_JITTER)
+    assert r == retval
     assert run.mock_calls == [
         mock.call(["echo"], env={"KEY": "VALUE"}, check=True),
         mock.call(["echo"], env={"KEY": "VALUE"}, check=True),
@@ -119,6 +125,47 @@ def test_ensure_call(run: mock.MagicMock, sleep: mock.MagicMock):
     sleep.assert_called_once_with(2)
 
 
+@mock.patch("instrumentation.record_command")
+@mock.patch("subprocess.run")
+def test_run_instrumentation(run: mock.MagicMock, record_command: mock.MagicMock):
+    run.return_value = subprocess.CompletedProcess([], 0, stdout=b"enabled", stderr=b"")
+    util.run(["/snap/bin/microk8s", "status", "-a", "dns"], capture_output=True)
+    record_command.assert_called_once_with("microk8s status", mock.ANY, 0, 7)
+
+    record_command.reset_mock()
+    run.side_effect = subprocess.CalledProcessError(2, "cmd", output=b"out", stderr=b"err")
+    with pytest.raises(subprocess.CalledProcessError):
+        util.run(["snap", "install", "microk8s"])
+    record_command.assert_called_once_with("snap install", mock.ANY, 2, 6)
+
+    record_command.reset_mock()
+    run.side_effect = FileNotFoundError()
+    with pytest.raises(FileNotFoundError):
+        util.run(["openssl", "genrsa"])
+    record_command.assert_called_once_with("openssl genrsa", mock.ANY, None, 0)
+
+
+@mock.patch("time.sleep")
+@mock.patch("subprocess.run")
+def test_ensure_call_permanent_error(run: mock.MagicMock, sleep: mock.MagicMock):
+    policy = util.RetryPolicy(permanent_exit_codes=(3,), permanent_stderr=("Invalid token",))
+
+    # permanent exit code
+    run.side_effect = subprocess.CalledProcessError(3, "cmd")
+    with pytest.raises(subprocess.CalledProcessError):
+        util.ensure_call(["echo"], retry_policy=policy)
+    run.assert_called_once()
+
+    # permanent error message
+    run.reset_mock()
+    run.side_effect = subprocess.CalledProcessError(1, "cmd", stderr=b"Error: Invalid token")
+    with pytest.raises(subprocess.CalledProcessError):
+        util.ensure_call(["echo"], retry_policy=policy)
+    run.assert_called_once()
+
+    sleep.assert_not_called()
+
+
 @mock.patch("time.sleep")
 def test_ensure_func(sleep: mock.MagicMock):
     m = mock.MagicMock()
@@ -129,7 +176,7 @@ def test_ensure_func(sleep: mock.MagicMock):
     # other exceptions are raised
     m.side_effect = ValueError("some error")
     with pytest.raises(ValueError):
-        util._ensure_func(m, args, kwargs, retry_on=KeyError, backoff=20)
+        util.ensure_func(m, args, kwargs, retry_on=KeyError, policy=NO_JITTER)
 
     m.assert_called_once_with(*args, **kwargs)
     sleep.assert_not_called()
@@ -137,22 +184,96 @@ def test_ensure_func(sleep: mock.MagicMock):
     # eventually succeeds (side effect raises 5 exceptions, then succeeds)
     m.reset_mock()
     m.side_effect = [ValueError("some error")] * 5 + ["retval"]
-    r = util._ensure_func(m, args, kwargs, retry_on=ValueError, backoff=20)
+    r = util.ensure_func(m, args, kwargs, retry_on=ValueError, policy=NO_JITTER)
     assert m.mock_calls == [mock.call(*args, **kwargs)] * 6
-    assert sleep.mock_calls == [mock.call(20)] * 5
+    assert sleep.mock_calls == [mock.call(2), mock.call(4), mock.call(8), mock.call(16)] + [
+        mock.call(20)
+    ]
     assert r == "retval"
 
-    # exception is raised after max_retries
+    # exception is raised after max_attempts
     sleep.reset_mock()
     m.reset_mock()
     m.side_effect = [ValueError("some error")] * 5
+    policy = util.RetryPolicy(initial_delay=20, max_delay=20, jitter=0, max_attempts=3)
     with pytest.raises(ValueError):
-        util._ensure_func(m, args, kwargs, retry_on=ValueError, max_retries=3, backoff=20)
+        util.ensure_func(m, args, kwargs, retry_on=ValueError, policy=policy)
 
     assert m.mock_calls == [mock.call(*args, **kwargs)] * 3
     assert sleep.mock_calls == [mock.call(20)] * 2
 
 
+@pytest.mark.parametrize(
+    "status, attempts", [(403, 1), (409, 1), (422, 1), (429, 3), (500, 3), (503, 3)]
+)
+@mock.patch("time.sleep")
+def test_ensure_func_http_status(sleep: mock.MagicMock, status: int, attempts: int):
+    m = mock.MagicMock(side_effect=kubeapi.KubernetesError(status, "error"))
+
+    # client errors fail fast, except for too many requests
+    policy = util.RetryPolicy(jitter=0, max_attempts=3)
+    with pytest.raises(kubeapi.KubernetesError):
+        util.ensure_func(m, [], {}, retry_on=kubeapi.KubernetesError, policy=policy)
+
+    assert m.call_count == attempts
+
+
+@mock.patch("time.sleep")
+@mock.patch("time.monotonic")
+def test_ensure_func_deadline(monotonic: mock.MagicMock, sleep: mock.MagicMock):
+    m = mock.MagicMock(side_effect=ValueError("some error"))
+    monotonic.return_value = util.HOOK_START + 9
+
+    # retrying would exceed the hook deadline
+    policy = util.RetryPolicy(initial_delay=2, jitter=0, deadline=10)
+    with pytest.raises(ValueError):
+        util.ensure_func(m, [], {}, retry_on=ValueError, policy=policy)
+
+    m.assert_called_once_with()
+    sleep.assert_not_called()
+
+
+@mock.patch("instrumentation.record_retries")
+@mock.patch("time.sleep")
+def test_ensure_func_instrumentation(sleep: mock.MagicMock, record_retries: mock.MagicMock):
+    m = mock.MagicMock(side_effect=[ValueError("some error"), "retval"], __qualname__="f")
+    util.ensure_func(m, [], {}, retry_on=ValueError, policy=NO_JITTER)
+    record_retries.assert_called_once_with("f", 1, mock.ANY, True)
+
+    record_retries.reset_mock()
+    m.side_effect = ValueError("some error")
+    with pytest.raises(ValueError):
+        util.ensure_func(m, [], {}, retry_on=ValueError, policy=NO_JITTER)
+    record_retries.assert_called_once_with("f", 9, mock.ANY, False)
+
+
+@pytest.mark.parametrize("attempt, expected", [(1, 0.5), (2, 1), (3, 2), (4, 4), (5, 4), (10, 4)])
+def test_retry_policy_delay(attempt: int, expected: float):
+    policy = util.RetryPolicy()
+    assert expected * 0.8 <= policy.delay(attempt) <= expected * 1.2
+
+
 def test_charm_dir():
     assert (util.charm_dir() / "metadata.yaml").exists()
     assert (util.charm_dir() / "src" / "charm.py").exists()
+
+
+def test_lazy_import(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    (tmp_path / "fakemodule.py").write_text("import fakeloaded\nVALUE = 42\n")
+    (tmp_path / "fakeloaded.py").write_text("")
+    monkeypatch.syspath_prepend(tmp_path)
+    monkeypatch.delitem(sys.modules, "fakemodule", raising=False)
+    monkeypatch.delitem(sys.modules, "fakeloaded", raising=False)
+
+    module = util.lazy_import("fakemodule")
+    assert "fakeloaded" not in sys.modules
+
+    # loaded on first access
+    assert module.VALUE == 42
+    assert "fakeloaded" in sys.modules
+
+    # already imported modules are returned as is
+    assert util.lazy_import("fakemodule") is module
+
+    with pytest.raises(ModuleNotFoundError):
+        util.lazy_import("fakemissingmodule")